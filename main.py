@@ -1,57 +1,141 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+
+import requests
+from requests.adapters import HTTPAdapter
+
 from yadisk_file_gateway import yadisk_file_gateway
 
-# # Загрузка файла по URL на Яндекс.Диск
-# args = {
-#     "action": "upload",
-#     "oauth_token": "YOUR_OAUTH_TOKEN_HERE",  # Замените на ваш токен
-#     "disk_path": "disk:/MirON42_feat._WANTARAM__CWAMI_-_Devochka_solntse.mp3",
-#     # "local_path": "D:/143214321.mp3",  # локальный путь
-#     "file_url": "https://mp3bob.ru/download/muz18/MirON42_feat._WANTARAM__CWAMI_-_Devochka_solntse.mp3",  # ссылка на файл в интернете
-#     "overwrite": True,          # перезаписать, если уже есть
-#     "show_progress": True       # показать прогресс-бар
-# }
-# print(yadisk_file_gateway(args))
-
-# # Получение ссылки для скачивания приватного файла (по OAuth)
-# args = {
-#     "action": "download",
-#     "oauth_token": "",  # Замените на ваш токен
-#     "disk_path": "disk:/file3.mp3"
-# }
-# print(yadisk_file_gateway(args))
-#
+# OAuth-токен Яндекс.Диска — один на все вызовы (замените на ваш токен)
+TOKEN = "<YA_OAUTH_TOKEN>"
+
+# Не больше 6 одновременных соединений к одному хосту (как в браузерах):
+# при большем числе Яндекс начинает отвечать 429/503, и повторы только замедляют работу
+MAX_CONNECTIONS_PER_HOST = 6
+
+# Общая HTTP-сессия с пулом keep-alive соединений: вызовы переиспользуют
+# TCP/TLS-соединения с cloud-api.yandex.net и downloader.disk.yandex.ru
+# вместо нового рукопожатия на каждый запрос.
+# Повторы здесь не настраиваем — гейтвей сам повторяет запросы при ошибках.
+# pool_block=True: лишний поток ждет свободное соединение, а не открывает новое,
+# которое после запроса было бы выброшено из переполненного пула
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+                                      pool_block=True))
+SESSION.headers["Connection"] = "keep-alive"
+
+# Один пул потоков на весь скрипт (не создаем новый пул на каждый вызов).
+# Гейтвей синхронный, поэтому event loop выполняет его вызовы в этом пуле;
+# все операции — сетевой ввод-вывод, поэтому потоки не упираются в GIL.
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS_PER_HOST)
+
+
+async def run(args, host_sem):
+    """Вызывает гейтвей, не превышая лимит соединений к хосту"""
+    async with host_sem:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(EXECUTOR, yadisk_file_gateway, args)
+
+
+async def run_chain(chain, host_sem):
+    """
+    Выполняет цепочку зависимых вызовов последовательно
+    (например, rename и затем delete того же файла)
+    """
+    return [await run(args, host_sem) for args in chain]
+
+
+async def main(plan):
+    """Запускает все цепочки плана одновременно в одном event loop"""
+    # Общий для всех цепочек ограничитель параллельных вызовов гейтвея
+    host_sem = asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST)
+    return await asyncio.gather(*(run_chain(chain, host_sem) for chain in plan))
+
+
+def compile_plan(jobs):
+    """
+    Один раз превращает цепочки аргументов в неизменяемый план:
+    общая сессия подставляется заранее, а не копированием словаря на каждый вызов
+    """
+    return tuple(
+        tuple(MappingProxyType({**args, "_session": SESSION}) for args in chain)
+        for chain in jobs
+    )
+
+
+# Загрузка файла по URL на Яндекс.Диск
+upload_args = {
+    "action": "upload",
+    "oauth_token": TOKEN,
+    "disk_path": "disk:/MirON42_feat._WANTARAM__CWAMI_-_Devochka_solntse.mp3",
+    # "local_path": "D:/143214321.mp3",  # локальный путь
+    "file_url": "https://mp3bob.ru/download/muz18/MirON42_feat._WANTARAM__CWAMI_-_Devochka_solntse.mp3",  # ссылка на файл в интернете
+    "overwrite": True,          # перезаписать, если уже есть
+    "show_progress": True,      # показать прогресс-бар
+    # "return_public_url": True,  # опубликовать файл и вернуть публичную ссылку
+    "progress_interval": 0.25   # перерисовывать прогресс не чаще раза в 0.25 с
+}
+
+# Получение ссылки для скачивания приватного файла (по OAuth)
+private_download_args = {
+    "action": "download",
+    "oauth_token": TOKEN,
+    "disk_path": "disk:/file3.mp3",
+    # "parallel_parts": 4,    # скачивание в кэш Colab в 4 соединения
+    # "resume_offset": 0,     # докачка в кэш Colab: сколько байт уже скачано
+    # "expected_total": 0,    # полный размер файла — запасной, если Диск не сообщил размер
+}
+
 # Получение ссылки для скачивания по публичной ссылке (без OAuth)
-args = {
+public_download_args = {
     "action": "download",
     "public_key": "https://disk.yandex.ru/d/nkiBskZzyG5rNw",
     "public_path": ""   # опционально (если в опубликованной папке)
 }
-print(yadisk_file_gateway(args))
-#
+
 # Переименование файла
-# args = {
-#     "action": "rename",
-#     "oauth_token": "<YA_OAUTH_TOKEN>",
-#     "disk_path": "disk:/file1.mp3",
-#     "new_name": "file55555.mp3"
-# }
-# print(yadisk_file_gateway(args))
-#
+rename_args = {
+    "action": "rename",
+    "oauth_token": TOKEN,
+    "disk_path": "disk:/file1.mp3",
+    "new_name": "file55555.mp3"
+}
+
 # Удаление файла
-# args = {
-#     "action": "delete",
-#     "oauth_token": "<YA_OAUTH_TOKEN>",
-#     "disk_path": "disk:/file2.mp3"
-# }
-# print(yadisk_file_gateway(args))
-#
-# # Листинг содержимого папки
-# args = {
-#     "action": "list",
-#     "oauth_token": "<YA_OAUTH_TOKEN>",
-#     "disk_path": "disk:/",    # путь к папке
-#     "limit": 50,                     # сколько элементов вернуть
-#     "offset": 0                      # с какого индекса начать (для пагинации)
-# }
-# print(yadisk_file_gateway(args))
+delete_args = {
+    "action": "delete",
+    "oauth_token": TOKEN,
+    "disk_path": "disk:/file2.mp3"
+}
+
+# Листинг содержимого папки
+list_args = {
+    "action": "list",
+    "oauth_token": TOKEN,
+    "disk_path": "disk:/",    # путь к папке
+    "limit": 50,                     # сколько элементов вернуть
+    "offset": 0,                     # с какого индекса начать (для пагинации)
+    # "fetch_all": True,     # вся папка сразу: страницы по limit запрашиваются параллельно
+    # "cache_path": "~/.yadisk_cache.json",  # кэш list по ETag между запусками
+}
+
+# Каждый элемент — независимая цепочка вызовов: цепочки выполняются параллельно,
+# вызовы внутри одной цепочки — по порядку (если один вызов зависит от другого,
+# например rename и затем delete того же файла, кладите их в одну цепочку).
+# Раскомментируйте нужные операции.
+jobs = [
+    # [upload_args],
+    # [private_download_args],
+    [public_download_args],
+    # [rename_args],
+    # [delete_args],
+    # [list_args],
+]
+
+PLAN = compile_plan(jobs)
 
+with EXECUTOR:
+    for results in asyncio.run(main(PLAN)):
+        for result in results:
+            print(result)
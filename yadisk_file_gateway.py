@@ -1,3 +1,712 @@
+import functools
+import hashlib  # Для ключей кэша list (без хранения токена в открытом виде)
+import json
+import math
+import mimetypes
+import os
+import queue
+import random
+import re
+import string
+import sys
+import tempfile
+import threading
+import time  # Для retry логики
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor  # Для параллельного скачивания частями и ссылок list
+from typing import Optional, Dict, Any
+from urllib.parse import quote, unquote, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+
+# Разбор JSON-ответов прямо из байтов тела: orjson, если установлен, иначе стандартный json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Пул переиспользуемых буферов для передачи данных, общий для всех вызовов:
+# буферы по 1 MB создаются по требованию и возвращаются в пул после передачи
+_BUFFER_SIZE = 1024 * 1024
+_BUFFER_POOL = queue.LifoQueue(maxsize=8)
+
+
+def _acquire_buffer() -> bytearray:
+    try:
+        return _BUFFER_POOL.get_nowait()
+    except queue.Empty:
+        return bytearray(_BUFFER_SIZE)
+
+
+def _release_buffer(buf: bytearray) -> None:
+    try:
+        _BUFFER_POOL.put_nowait(buf)
+    except queue.Full:
+        pass
+
+
+# Размер чанка при потоковом чтении ответов: 1 MB вместо 8 KB — в 128 раз меньше
+# итераций Python-цикла на каждый переданный байт
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Все 31 вариант полосы прогресса строятся один раз: отрисовка берет готовую строку
+# по числу заполненных делений, без срезов и склейки
+_BAR_LEN = 30
+_BARS = tuple("#" * filled + "-" * (_BAR_LEN - filled) for filled in range(_BAR_LEN + 1))
+
+# Общая блокировка вывода: при параллельных вызовах гейтвея строки прогресса
+# из разных потоков не перемешиваются
+_STDOUT_LOCK = threading.Lock()
+
+
+def _write_progress(line: str) -> None:
+    """Выводит строку прогресса одной записью и одним flush под блокировкой"""
+    # Через sys.stdout, а не os.write в дескриптор: сохраняются его кодировка (консоль Windows,
+    # PYTHONIOENCODING) и любые подмены потока (redirect_stdout, Jupyter/Colab)
+    with _STDOUT_LOCK:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+# Специальные заголовки для Google Colab (общие для всех запросов через retry-обертку)
+_COLAB_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    # Сжатые JSON-ответы (list и др.), но только в тех форматах, которые установленный
+    # urllib3 умеет распаковать (br — лишь при наличии пакета brotli)
+    'Accept-Encoding': DEFAULT_ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Cache-Control': 'max-age=0'
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _auth_headers(token: str) -> dict:
+    # Словарь кэшируется и общий для всех вызовов с этим токеном — не изменять его,
+    # для дополнительных заголовков делать копию ({**headers, ...}).
+    # 32 токена — запас для пакетных запусков по нескольким аккаунтам без вытеснения.
+    # Кэш держит токены в памяти процесса до вытеснения (см. _auth_headers.cache_clear())
+    return {"Authorization": f"OAuth {token}", "Accept": "application/json"}
+
+
+@functools.lru_cache(maxsize=256)
+def _content_type_for_ext(ext: str) -> str:
+    return mimetypes.guess_type("f" + ext)[0] or "application/octet-stream"
+
+
+def _content_type(path: str) -> str:
+    """Content-Type для PUT по расширению файла на Диске (кэшируется по расширению)"""
+    return _content_type_for_ext(os.path.splitext(path)[1].lower())
+
+
+@functools.lru_cache(maxsize=1024)
+def _norm_disk_path(path: str) -> str:
+    # Кэш: в пакетных запусках одни и те же пути приходят повторно
+    if not path:
+        return ""
+    if path.startswith("disk:/"):
+        return path
+    return f"disk:/{path.lstrip('/')}"
+
+
+@functools.lru_cache(maxsize=1024)
+def _disk_client_url(path: str) -> str:
+    """Ссылка на ресурс в веб-интерфейсе Диска (для владельца), строится без запроса к API"""
+    return f"https://disk.yandex.ru/client/disk/{quote(path.replace('disk:/', '', 1).lstrip('/'))}"
+
+
+# Хосты публичных ссылок Яндекс.Диска: такой файл копируется на Диск на стороне сервера
+# (save-to-disk), без скачивания и повторной загрузки через гейтвей
+_YADISK_PUBLIC_HOSTS = frozenset(["disk.yandex.ru", "disk.yandex.com", "yadi.sk"])
+# Опрос асинхронной операции копирования: интервал и предельное время, сек
+_OPERATION_POLL_INTERVAL = 1.0
+_OPERATION_TIMEOUT = 600.0
+
+
+# Сколько символов тела ответа без JSON-полей ошибки попадает в сообщение
+_ERROR_TEXT_LIMIT = 512
+
+
+# Поддерживаемые действия; для всех, кроме download, обязательны oauth_token и disk_path
+_ACTIONS = frozenset(["upload", "download", "rename", "delete", "list"])
+_PRIVATE_ACTIONS = frozenset(["upload", "rename", "delete", "list"])
+
+
+# Недопустимые символы во входных строках: один скомпилированный класс символов
+# на каждый вид проверки, .search() останавливается на первом совпадении.
+# Списки (в исходном порядке) нужны для текста сообщений об ошибках
+_TOKEN_BAD_RE = re.compile(r'[<>"\'&\x00\n\r]')
+_URL_BAD_RE = re.compile(r'[<>"\'\x00\n\r]')
+_PUBLIC_URL_BAD_RE = re.compile(r'[<>"\'&\x00]')
+# Хэши токенов, уже прошедших проверку (в этом наборе — только хэши). Сами токены при этом
+# остаются в памяти процесса: в ключах _RESOURCE_CACHE и _UPLOAD_HREF_CACHE и в кэше
+# _auth_headers, который хранит готовый заголовок Authorization
+_VALIDATED_TOKENS = set()
+# ':' в пути разрешен — он нужен для префикса disk:/
+_DISK_PATH_INVALID_CHARS = ['<', '>', '"', '|', '?', '*']
+_PATH_BAD_RE = re.compile(r'[<>"|?*]')
+_FILE_NAME_INVALID_CHARS = ['<', '>', ':', '"', '|', '?', '*', '/', '\\']
+_NAME_BAD_RE = re.compile(r'[<>:"|?*/\\]')
+
+
+# Регулярные выражения для извлечения прямой ссылки из HTML публичной страницы Яндекс.Диска
+_RE_DOWNLOAD_URL = re.compile(r'"downloadUrl":"([^"]+)"')
+_RE_DIRECT_URL = re.compile(r'https://downloader\.disk\.yandex\.ru/[^\s"\']+')
+# Только открывающий тег: конец скрипта ищется через str.find, без .*? с DOTALL
+_RE_REACT_DATA_OPEN = re.compile(r'<script[^>]*id=["\']react-data["\'][^>]*>')
+
+# Имя файла из Content-Disposition: и filename="...", и filename*=UTF-8''... (RFC 5987)
+_RE_CD_FILENAME = re.compile(r'filename\*?=(?:[\w-]+\'[^\']*\')?"?([^";]+)', re.IGNORECASE)
+# Полный размер из заголовка Content-Range ответа 206: "bytes 0-0/12345"
+_RE_CONTENT_RANGE_TOTAL = re.compile(r'/\s*(\d+)\s*$')
+
+
+# Среда выполнения и готовность директории кэша Colab не меняются за время жизни
+# процесса, поэтому определяются один раз
+_ENVIRONMENT = None
+_COLAB_CACHE_DIR = "/content/yadisk_cache"
+_COLAB_CACHE_DIR_READY = False
+
+
+def _detect_environment() -> str:
+    """
+    Определяет среду выполнения (Google Colab, Jupyter, обычный Python)
+    """
+    global _ENVIRONMENT
+    if _ENVIRONMENT is not None:
+        return _ENVIRONMENT
+    environment = "python"
+    try:
+        import google.colab
+        environment = "colab"
+    except ImportError:
+        try:
+            import IPython
+            if IPython.get_ipython() is not None:
+                environment = "jupyter"
+        except ImportError:
+            pass
+    _ENVIRONMENT = environment
+    return environment
+
+
+def _get_colab_cache_dir() -> str:
+    """
+    Получает путь к директории кэша для Google Colab
+    """
+    global _COLAB_CACHE_DIR_READY
+    if not _COLAB_CACHE_DIR_READY:
+        # Один системный вызов вместо exists + makedirs, без гонки между ними
+        os.makedirs(_COLAB_CACHE_DIR, exist_ok=True)
+        _COLAB_CACHE_DIR_READY = True
+    return _COLAB_CACHE_DIR
+
+
+def _backoff_delay(attempt: int, response=None) -> float:
+    """
+    Задержка перед повтором запроса: Retry-After от сервера (в секундах, не больше минуты),
+    иначе экспоненциальная со случайным разбросом, чтобы повторы разных клиентов не совпадали
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(int(retry_after), 60)
+    return random.uniform(0, 2 ** attempt) + 0.1
+
+
+# Короткоживущий кэш метаданных ресурсов (GET /resources) по (токен, путь):
+# цепочки вроде "информация о файле -> публичная ссылка" не повторяют один и тот же запрос.
+# Записи сбрасываются при изменении ресурса (upload, publish, rename, delete).
+# Размер ограничен: в долгоживущем процессе вытесняются самые старые записи
+_RESOURCE_CACHE_TTL = 5.0
+_RESOURCE_CACHE_MAX = 256
+_RESOURCE_CACHE = OrderedDict()
+_RESOURCE_CACHE_LOCK = threading.Lock()
+
+
+def _cached_resource(token: str, path: str) -> Optional[dict]:
+    """Метаданные ресурса из кэша, если запись еще не устарела (устаревшая удаляется)"""
+    key = (token, path)
+    with _RESOURCE_CACHE_LOCK:
+        cached = _RESOURCE_CACHE.get(key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= _RESOURCE_CACHE_TTL:
+            del _RESOURCE_CACHE[key]
+            return None
+    return cached[1]
+
+
+def _store_resource(token: str, path: str, fetched_at: float, data: dict) -> None:
+    key = (token, path)
+    with _RESOURCE_CACHE_LOCK:
+        _RESOURCE_CACHE[key] = (fetched_at, data)
+        _RESOURCE_CACHE.move_to_end(key)
+        while len(_RESOURCE_CACHE) > _RESOURCE_CACHE_MAX:
+            _RESOURCE_CACHE.popitem(last=False)
+
+
+def _invalidate_resource(token: str, path: str) -> None:
+    with _RESOURCE_CACHE_LOCK:
+        _RESOURCE_CACHE.pop((token, path), None)
+
+
+# Запись файла кэша list (cache_path): чтение, добавление записи и замена файла
+# выполняются под одной блокировкой, чтобы параллельные вызовы list не затирали друг друга
+_LIST_CACHE_LOCK = threading.Lock()
+
+
+# Ссылки для загрузки (GET /resources/upload) по (токен, путь): ссылка действует около
+# 30 минут, поэтому повтор неудавшейся загрузки того же файла не запрашивает ее заново.
+# Кэшируются только ссылки для overwrite=true: при overwrite=false именно запрос ссылки
+# возвращает 409, если файл уже есть, и повторно использованная ссылка молча перезаписала бы
+# файл, созданный в промежутке. Запись удаляется после успешной загрузки и при отказе
+# сервера принять ссылку (4xx); устаревшие записи удаляются при обращении и при добавлении
+_UPLOAD_HREF_TTL = 25 * 60.0
+_UPLOAD_HREF_MAX = 64
+_UPLOAD_HREF_CACHE = OrderedDict()
+_UPLOAD_HREF_LOCK = threading.Lock()
+
+
+def _cached_upload_href(key: tuple) -> Optional[str]:
+    """Ссылка для загрузки из кэша, если она еще действительна (устаревшая удаляется)"""
+    with _UPLOAD_HREF_LOCK:
+        cached = _UPLOAD_HREF_CACHE.get(key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= _UPLOAD_HREF_TTL:
+            del _UPLOAD_HREF_CACHE[key]
+            return None
+    return cached[1]
+
+
+def _store_upload_href(key: tuple, href: str) -> None:
+    now = time.monotonic()
+    with _UPLOAD_HREF_LOCK:
+        _UPLOAD_HREF_CACHE[key] = (now, href)
+        _UPLOAD_HREF_CACHE.move_to_end(key)
+        # Порядок вставки совпадает с порядком устаревания: старые записи — в начале
+        while _UPLOAD_HREF_CACHE and (len(_UPLOAD_HREF_CACHE) > _UPLOAD_HREF_MAX
+                                      or now - next(iter(_UPLOAD_HREF_CACHE.values()))[0] >= _UPLOAD_HREF_TTL):
+            _UPLOAD_HREF_CACHE.popitem(last=False)
+
+
+def _drop_upload_href(key: tuple) -> None:
+    with _UPLOAD_HREF_LOCK:
+        _UPLOAD_HREF_CACHE.pop(key, None)
+
+
+def _with_attachment_disposition(url: str) -> str:
+    """
+    Ставит в ссылке disposition=attachment, заменяя уже имеющийся параметр disposition.
+    Остальные параметры не декодируются и не перекодируются — подпись ссылки
+    downloader.disk.yandex.ru остается действительной
+    """
+    parts = urlsplit(url)
+    pairs = [pair for pair in parts.query.split("&")
+             if pair and pair.partition("=")[0] != "disposition"]
+    pairs.append("disposition=attachment")
+    return urlunsplit(parts._replace(query="&".join(pairs)))
+
+
+# HTML-страница для скачивания файла из кэша Google Colab (шаблон разбирается один раз)
+_COLAB_CACHE_PAGE_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Скачивание файла: $filename</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 40px; }
+        .download-btn { 
+            background-color: #4CAF50; 
+            color: white; 
+            padding: 15px 32px; 
+            text-align: center; 
+            text-decoration: none; 
+            display: inline-block; 
+            font-size: 16px; 
+            margin: 4px 2px; 
+            cursor: pointer; 
+            border-radius: 4px;
+        }
+        .info { background-color: #f0f0f0; padding: 15px; border-radius: 4px; margin: 20px 0; }
+    </style>
+    <script>
+        // Автоматическое скачивание при загрузке страницы
+        window.onload = function() {
+            var link = document.createElement('a');
+            link.href = '/content/yadisk_cache/$filename';
+            link.download = '$filename';
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            
+            // Показываем сообщение
+            document.getElementById('message').innerHTML = 'Файл скачивается...';
+        };
+    </script>
+</head>
+<body>
+    <h2>📁 Скачивание файла: $filename</h2>
+    <div class="info">
+        <p><strong>Статус:</strong> <span id="message">Подготовка к скачиванию...</span></p>
+        <p><strong>Размер файла:</strong> $file_size байт</p>
+        <p><strong>Время создания:</strong> $created_at</p>
+    </div>
+    
+    <p>Если скачивание не началось автоматически:</p>
+    <a href="/content/yadisk_cache/$filename" download="$filename" class="download-btn">
+        📥 Скачать файл
+    </a>
+    
+    <div class="info">
+        <h3>Инструкции:</h3>
+        <ol>
+            <li>Файл должен скачаться автоматически</li>
+            <li>Если не работает, нажмите кнопку "Скачать файл" выше</li>
+            <li>Файл также доступен по пути: <code>/content/yadisk_cache/$filename</code></li>
+        </ol>
+    </div>
+</body>
+</html>""")
+
+
+# Страница с автоматическим скачиванием по прямой ссылке (запасной вариант для Colab)
+_REDIRECT_PAGE_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Скачивание файла</title>
+    <script>
+        // Автоматическое скачивание при загрузке страницы
+        window.onload = function() {
+            var link = document.createElement('a');
+            link.href = '$href';
+            link.download = '$filename';
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            
+            // Показываем сообщение
+            document.getElementById('message').innerHTML = 'Файл скачивается...';
+        };
+    </script>
+</head>
+<body>
+    <h2>Скачивание файла: $filename</h2>
+    <p id="message">Подготовка к скачиванию...</p>
+    <p>Если скачивание не началось автоматически, <a href="$href" download="$filename">нажмите здесь</a></p>
+</body>
+</html>""")
+
+
+# Общая сессия requests для всех вызовов: keep-alive соединения переиспользуются,
+# TLS-рукопожатие с одним и тем же хостом выполняется один раз
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _get_session():
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                # Повторы делает сам гейтвей (_make_request_with_retry), поэтому max_retries=0
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _SESSION = session
+    return _SESSION
+
+
+_PAGE_SIZE = 4096
+
+
+def _choose_chunk_size(file_size: Optional[int], override: Optional[int]) -> int:
+    """
+    Размер чанка потоковой передачи по размеру файла (или из chunk_size).
+    Всегда кратен 4 КБ: чтения и записи идут целыми страницами
+    """
+    if override and override > 0:
+        return -(-int(override) // _PAGE_SIZE) * _PAGE_SIZE  # Округление вверх до страницы
+    if not file_size or file_size <= 10 * 1024 * 1024:  # ≤ 10 MB
+        return 512 * 1024
+    if file_size <= 100 * 1024 * 1024:
+        return 1 * 1024 * 1024
+    if file_size <= 1024 * 1024 * 1024:
+        return 2 * 1024 * 1024
+    return 4 * 1024 * 1024
+
+
+# file-like с прогрессом для upload из URL (потоковая загрузка).
+# Класс определен на уровне модуля, а не внутри гейтвея: не создается заново на каждый вызов
+class ProgressURLFile:
+    def __init__(self, session, url, show, progress_interval=0.25, chunk_size=None):
+        self._url = url
+        self._show = show
+        self._chunk_size = _choose_chunk_size(None, chunk_size)
+        self._progress_interval = progress_interval
+        self._last_render = 0.0
+        self._last_percent = None
+        self._next_tick = 0  # Сколько байт нужно прочитать, чтобы процент вырос
+        self._read = 0
+        self._size = 0  # Размер для прогресса (в том числе оценка по Range)
+        self._length = 0  # Точный размер тела из Content-Length (0 — неизвестен, chunked)
+        self._response = None
+        self._closed = False
+        self._error = None
+        self._raw = None
+
+        # Инициализируем потоковое соединение
+        try:
+            if self._show:
+                sys.stdout.write("Инициализация потокового соединения...\n")
+
+            # Настройки для надежного скачивания
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                'Accept': '*/*',
+                'Accept-Language': 'en-US,en;q=0.9',
+                'Accept-Encoding': 'identity',  # Отключаем сжатие для точности
+                'Connection': 'keep-alive',
+                'Cache-Control': 'no-cache'
+            }
+
+            self._response = self._open(session, url, headers)
+            if self._response is None:
+                return
+
+            # Получаем размер файла из заголовков
+            content_length = self._response.headers.get('Content-Length')
+            probed_size = None
+            if not content_length and not self._is_encoded(self._response):
+                # Источник отдает файл без Content-Length: узнаем размер одним запросом первого байта.
+                # Поток сначала закрываем, чтобы не держать два соединения к одному хосту
+                # (при pool_block=True и занятом пуле второе ждало бы бесконечно), затем открываем заново
+                url = self._response.url or url
+                self._response.close()
+                self._response = None
+                probed_size = self._probe_size(session, url, headers)
+                self._response = self._open(session, url, headers)
+                if self._response is None:
+                    return
+                content_length = self._response.headers.get('Content-Length')
+            # Источник мог проигнорировать Accept-Encoding: identity и прислать сжатое тело —
+            # тогда на Диск уходят распакованные байты, а Content-Length источника (размер
+            # сжатого тела) им не соответствует: размер неизвестен, PUT идет chunked
+            encoded = self._is_encoded(self._response)
+            if content_length and not encoded:
+                # Точный размер тела: его же передаем в PUT как Content-Length
+                self._length = self._size = int(content_length)
+            elif probed_size:
+                # Размер по Range — только для процентов: тело по-прежнему уходит chunked,
+                # так что расхождение с фактическим потоком не обрежет файл
+                self._size = int(probed_size)
+            if self._size:
+                # Размер известен — подбираем чанк под него (если chunk_size не задан явно)
+                self._chunk_size = _choose_chunk_size(self._size, chunk_size)
+                if self._show:
+                    sys.stdout.write(f"Размер файла: {self._size} байт\n")
+            else:
+                if self._show:
+                    sys.stdout.write("Размер файла неизвестен, будет показан прогресс в байтах\n")
+
+            # Проверка Content-Disposition для определения имени файла
+            content_disposition = self._response.headers.get('Content-Disposition', '')
+            cd_match = _RE_CD_FILENAME.search(content_disposition)
+            if cd_match:
+                filename = unquote(cd_match.group(1).strip())
+                if self._show:
+                    sys.stdout.write(f"Имя файла по заголовку: {filename}\n")
+
+            # Читаем напрямую из сокетного потока urllib3, без промежуточного генератора iter_content
+            self._raw = self._response.raw
+            # Несжатое тело передаем на Диск как есть, без слоя распаковки (Content-Length, отданный
+            # в PUT, описывает именно байты тела ответа); сжатое — распаковываем, иначе на Диск
+            # попал бы gzip вместо файла
+            self._raw.decode_content = encoded
+
+            if self._show:
+                sys.stdout.write(f"Content-Type: {self._response.headers.get('Content-Type', '')}\n")
+                sys.stdout.write("Начинаем потоковую загрузку на Яндекс.Диск...\n")
+
+        except requests.exceptions.RequestException as e:
+            self._error = f"Ошибка сети при инициализации соединения: {e}"
+            if self._show:
+                sys.stdout.write(f"\nОшибка: {self._error}\n")
+        except Exception as e:
+            self._error = f"Неожиданная ошибка при инициализации: {e}"
+            if self._show:
+                sys.stdout.write(f"\nОшибка: {self._error}\n")
+
+    def _open(self, session, url, headers):
+        """Открывает потоковый GET источника; при ошибке (статус, HTML) закрывает его и возвращает None"""
+        response = session.get(
+            url,
+            headers=headers,
+            timeout=600,
+            allow_redirects=True,
+            stream=True,  # Важно: потоковое скачивание
+            verify=True  # Проверяем SSL сертификаты
+        )
+
+        # Статус, тип и размер берем из ответа самого GET: отдельный HEAD
+        # стоил бы лишнего запроса к источнику при каждой загрузке
+        if response.status_code >= 400:
+            self._error = f"Указанная ссылка недоступна (код {response.status_code})."
+        else:
+            # HTML-страница вместо файла: тело не читаем
+            content_type = response.headers.get('Content-Type', '')
+            if 'text/html' in content_type.lower():
+                self._error = f"Получен HTML-ответ ({content_type}) вместо файла! Проверьте URL."
+        if self._error:
+            response.close()
+            if self._show:
+                sys.stdout.write(f"Ошибка: {self._error}\n")
+            return None
+        return response
+
+    @staticmethod
+    def _is_encoded(response):
+        """True, если тело ответа сжато (Content-Encoding, отличный от identity)"""
+        return response.headers.get('Content-Encoding', '').strip().lower() not in ('', 'identity')
+
+    @staticmethod
+    def _probe_size(session, url, headers):
+        """Размер файла по Content-Range ответа на Range: bytes=0-0 (None, если не удалось)"""
+        try:
+            probe = session.get(url, headers={**headers, 'Range': 'bytes=0-0'}, timeout=30, stream=True)
+        except requests.exceptions.RequestException:
+            return None
+        try:
+            if probe.status_code != 206:
+                return None
+            match = _RE_CONTENT_RANGE_TOTAL.search(probe.headers.get('Content-Range', ''))
+            return match.group(1) if match else None
+        finally:
+            probe.close()
+
+    def __len__(self):
+        # Только точный размер из Content-Length: по нему requests выставляет Content-Length PUT
+        return self._length
+
+    def __bool__(self):
+        # Без этого объект с неизвестным размером (len == 0) ложен, и requests
+        # (data=data or {}) отправил бы вместо него пустое тело
+        return True
+
+    def __iter__(self):
+        # Итерируемый объект requests передает потоком: байты идут из источника
+        # сразу в PUT, без буферизации файла (при неизвестном размере — chunked).
+        # Метода read() у объекта нет намеренно: для файлоподобного тела urllib3
+        # сам читает его блоками по 16 КБ, а итератор отдает чанки целиком.
+        # Источник читает фоновый поток: пока PUT отправляет один чанк, следующий
+        # уже скачивается; очередь ограничена, в памяти не больше 8 чанков
+        if self._closed or self._raw is None:
+            return
+        chunks = queue.Queue(maxsize=8)
+        reader = threading.Thread(target=self._produce, args=(chunks,), daemon=True)
+        reader.start()
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            self._read += len(chunk)
+            if self._show:
+                self._render_progress()
+            yield chunk
+        self._raw = None
+        if self._error:
+            if self._show:
+                sys.stdout.write(f"\nОшибка: {self._error}\n")
+        elif self._show and self._length == 0:
+            sys.stdout.write(f"\nЗагрузка завершена: {self._read} байт\n")
+
+    def _put(self, chunks, item):
+        # Ждем места в очереди, пока объект не закрыт (PUT мог оборваться и больше не читать)
+        while not self._closed:
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, chunks):
+        """Фоновое чтение источника чанками в очередь; None в очереди — конец потока"""
+        raw_read = self._raw.read
+        chunk_size = self._chunk_size
+        try:
+            while not self._closed:
+                chunk = raw_read(chunk_size)
+                if not chunk or not self._put(chunks, chunk):
+                    break
+        except Exception as e:
+            if not self._closed:
+                self._error = f"Ошибка при чтении потока: {e}"
+        finally:
+            self._put(chunks, None)
+
+    def _render_progress(self):
+        # Показываем прогресс загрузки (не чаще раза в progress_interval секунд,
+        # последний чанк — всегда)
+        finished = self._size > 0 and self._read >= self._size
+        # При известном размере до порога следующего процента ничего не считаем
+        if self._size > 0 and not finished and self._read < self._next_tick:
+            return
+        now = time.monotonic()
+        if not finished and now - self._last_render < self._progress_interval:
+            return
+        self._last_render = now
+        if self._size > 0:
+            # Источник может отдать больше байт, чем известный (оценочный) размер:
+            # процент ограничиваем 100, иначе индекс вышел бы за пределы _BARS
+            percent = min(self._read * 100 // self._size, 100)
+            # Первый байт, на котором процент станет percent + 1
+            self._next_tick = ((percent + 1) * self._size + 99) // 100
+            # Пишем только когда процент вырос; строка и перевод строки — одной записью
+            if percent != self._last_percent:
+                self._last_percent = percent
+                filled = min(percent * _BAR_LEN // 100, _BAR_LEN)
+                bar = _BARS[filled]
+                _write_progress(f"\rЗагрузка на диск [{bar}] {percent:3d}%" + ("\n" if finished else ""))
+        else:
+            # Если размер неизвестен, показываем в байтах
+            _write_progress(f"\rЗагружено: {self._read} байт")
+
+    def close(self):
+        self._closed = True
+        # Закрываем потоковое соединение
+        try:
+            if self._response:
+                self._response.close()
+            if self._show:
+                sys.stdout.write("Потоковое соединение закрыто\n")
+        except Exception:
+            pass
+
+    def has_error(self):
+        """Возвращает True, если произошла ошибка при загрузке"""
+        return self._error is not None
+
+    def get_error(self):
+        """Возвращает сообщение об ошибке"""
+        return self._error
+
+    def get_bytes_read(self):
+        """Возвращает число байт, переданных из источника"""
+        return self._read
+
+
 def yadisk_file_gateway(arguments):
     """
     Яндекс.Диск helper (только ссылки):
@@ -11,60 +720,49 @@ def yadisk_file_gateway(arguments):
       - limit: минимальное значение 10 (значения <= 0 автоматически заменяются на 10)
                Для Яндекс.Диска limit=0 означает "верни 0 элементов" и ломает логику
     """
-    import os
-    import json
-    import sys
-    import re  # Для парсинга HTML
-    import time  # Для retry логики
-    from typing import Optional, Dict, Any
-    import requests
-
     BASE = "https://cloud-api.yandex.net/v1/disk"
 
-    # ---------- helpers ----------
-    def _auth_headers(token: str) -> Dict[str, str]:
-        return {"Authorization": f"OAuth {token}", "Accept": "application/json"}
-
-    def _norm_disk_path(path: str) -> str:
-        if not path:
-            return ""
-        if path.startswith("disk:/"):
-            return path
-        return f"disk:/{path.lstrip('/')}"
+    # HTTP-клиент: по умолчанию общая сессия модуля; вызывающий код может передать
+    # свой requests.Session в "_session" (например, с другим размером пула)
+    session = arguments.get("_session") or _get_session()
 
-    def _validate_inputs(arguments: Dict[str, Any]) -> Optional[str]:
+    # ---------- helpers ----------
+    def _validate_inputs(arguments: Dict[str, Any], action: Optional[str], token: str) -> Optional[str]:
         """
         Валидация входных параметров
+        action и token уже прочитаны и очищены вызывающим кодом
         Возвращает None если все OK, иначе сообщение об ошибке
         """
-        action = arguments.get("action")
         if not action:
             return "Не указан action"
         
-        if action not in ["upload", "download", "rename", "delete", "list"]:
+        if action not in _ACTIONS:
             return f"Неизвестное действие: {action}"
         
         # Валидация OAuth токена
-        token = arguments.get("oauth_token", "").strip()
-        if action in ["upload", "rename", "delete", "list"]:
+        if action in _PRIVATE_ACTIONS:
             if not token:
                 return f"Для действия '{action}' требуется oauth_token"
-            if len(token) < 10:  # Минимальная длина токена
-                return "OAuth токен слишком короткий"
-            # Проверка на потенциально опасные символы в токене
-            dangerous_chars = ['<', '>', '"', "'", '&', '\x00', '\n', '\r']
-            if any(char in token for char in dangerous_chars):
-                return "OAuth токен содержит недопустимые символы"
+            # Токен, уже прошедший проверку в этом процессе, повторно не проверяем
+            token_hash = hash(token)
+            if token_hash not in _VALIDATED_TOKENS:
+                if len(token) < 10:  # Минимальная длина токена
+                    return "OAuth токен слишком короткий"
+                # Проверка на потенциально опасные символы в токене
+                if _TOKEN_BAD_RE.search(token):
+                    return "OAuth токен содержит недопустимые символы"
+                if len(_VALIDATED_TOKENS) >= 128:
+                    _VALIDATED_TOKENS.clear()
+                _VALIDATED_TOKENS.add(token_hash)
         
         # Валидация путей
         disk_path = arguments.get("disk_path", "")
-        if action in ["upload", "rename", "delete", "list"]:
+        if action in _PRIVATE_ACTIONS:
             if not disk_path:
                 return f"Для действия '{action}' требуется disk_path"
             # Проверка на недопустимые символы в пути (исключаем ':' так как он нужен для disk:/)
-            invalid_chars = ['<', '>', '"', '|', '?', '*']
-            if any(char in disk_path for char in invalid_chars):
-                return f"Путь содержит недопустимые символы: {invalid_chars}"
+            if _PATH_BAD_RE.search(disk_path):
+                return f"Путь содержит недопустимые символы: {_DISK_PATH_INVALID_CHARS}"
         
         # Валидация URL
         file_url = arguments.get("file_url", "")
@@ -76,8 +774,7 @@ def yadisk_file_gateway(arguments):
             if len(file_url) > 2048:  # Ограничение длины URL
                 return "URL слишком длинный (максимум 2048 символов)"
             # Проверка на потенциально опасные символы в URL
-            dangerous_chars = ['<', '>', '"', "'", '\x00', '\n', '\r']
-            if any(char in file_url for char in dangerous_chars):
+            if _URL_BAD_RE.search(file_url):
                 return "URL содержит недопустимые символы"
         
         # Валидация new_name для rename
@@ -87,153 +784,147 @@ def yadisk_file_gateway(arguments):
                 return "Для rename требуется new_name"
             if len(new_name) > 255:  # Ограничение длины имени файла
                 return "Имя файла слишком длинное (максимум 255 символов)"
-            invalid_chars = ['<', '>', ':', '"', '|', '?', '*', '/', '\\']
-            if any(char in new_name for char in invalid_chars):
-                return f"Имя файла содержит недопустимые символы: {invalid_chars}"
-        
-        # Валидация числовых параметров
-        # Примечание: limit <= 0 будет автоматически заменен на минимальное значение (10) в основном коде
-        # Минимальный лимит для Яндекс.Диска: 10 (API не принимает 0, что означает "верни 0 элементов")
-        limit = arguments.get("limit", 100)
-        # Валидация limit перенесена в основной код для автоматической подмены проблемных значений
-        
-        offset = arguments.get("offset", 0)
-        if isinstance(offset, (int, str)) and int(offset) < 0:
-            return "offset не может быть отрицательным"
+            if _NAME_BAD_RE.search(new_name):
+                return f"Имя файла содержит недопустимые символы: {_FILE_NAME_INVALID_CHARS}"
         
-        chunk_size = arguments.get("chunk_size")
-        if chunk_size is not None:
+        # Валидация числовых параметров: каждое действие проверяет только те параметры,
+        # которые использует, и не платит за разбор чужих
+        progress_interval = arguments.get("progress_interval")
+        if progress_interval is not None:
+            # Только число (bool и строки не принимаем); NaN/inf сломали бы сравнение с интервалом
+            if isinstance(progress_interval, bool) or not isinstance(progress_interval, (int, float)) \
+                    or not math.isfinite(progress_interval):
+                return "progress_interval должен быть числом"
+            if progress_interval < 0:
+                return "progress_interval не может быть отрицательным"
+
+        if action == "list":
+            # Примечание: limit <= 0 будет автоматически заменен на минимальное значение (10) в основном коде
+            # Минимальный лимит для Яндекс.Диска: 10 (API не принимает 0, что означает "верни 0 элементов")
+            # Валидация limit перенесена в основной код для автоматической подмены проблемных значений,
+            # здесь проверяем только, что это число
             try:
-                chunk_size = int(chunk_size)
-                if chunk_size < 1024 or chunk_size > 10 * 1024 * 1024:  # От 1KB до 10MB
-                    return "chunk_size должен быть от 1024 до 10485760 байт"
+                int(arguments.get("limit", 100))
             except (ValueError, TypeError):
-                return "chunk_size должен быть числом"
+                return "limit должен быть числом"
+
+            try:
+                if int(arguments.get("offset", 0)) < 0:
+                    return "offset не может быть отрицательным"
+            except (ValueError, TypeError):
+                return "offset должен быть числом"
+
+        elif action == "download":
+            parallel_parts = arguments.get("parallel_parts")
+            if parallel_parts is not None:
+                try:
+                    if not 1 <= int(parallel_parts) <= 6:  # Не больше 6 соединений к одному хосту
+                        return "parallel_parts должен быть от 1 до 6"
+                except (ValueError, TypeError):
+                    return "parallel_parts должен быть числом"
+
+            for key in ("resume_offset", "expected_total"):
+                value = arguments.get(key)
+                if value is not None:
+                    try:
+                        if int(value) < 0:
+                            return f"{key} не может быть отрицательным"
+                    except (ValueError, TypeError):
+                        return f"{key} должен быть числом"
+
+        elif action == "upload":
+            chunk_size = arguments.get("chunk_size")
+            if chunk_size is not None:
+                try:
+                    chunk_size = int(chunk_size)
+                    if chunk_size < 1024 or chunk_size > 10 * 1024 * 1024:  # От 1KB до 10MB
+                        return "chunk_size должен быть от 1024 до 10485760 байт"
+                except (ValueError, TypeError):
+                    return "chunk_size должен быть числом"
         
         return None
 
     def _json_error(resp: requests.Response) -> str:
+        # Текст ошибки берем из полей ответа, без повторной сериализации JSON;
+        # сырое тело обрезаем, чтобы большая HTML-страница ошибки не попала в сообщение целиком
         try:
-            j = resp.json()
-            msg = j.get("message") or j.get("description") or json.dumps(j, ensure_ascii=False)
+            j = _json_loads(resp.content)
+            msg = j.get("message") or j.get("description") or j.get("error") or resp.text[:_ERROR_TEXT_LIMIT]
         except Exception:
-            msg = resp.text
+            msg = resp.text[:_ERROR_TEXT_LIMIT]
         return f"HTTP {resp.status_code}: {msg}".strip()
 
-    def _choose_chunk_size(file_size: Optional[int], override: Optional[int]) -> int:
-        if override and override > 0:
-            return int(override)
-        if not file_size or file_size <= 10 * 1024 * 1024:  # ≤ 10 MB
-            return 512 * 1024
-        if file_size <= 100 * 1024 * 1024:
-            return 1 * 1024 * 1024
-        if file_size <= 1024 * 1024 * 1024:
-            return 2 * 1024 * 1024
-        return 4 * 1024 * 1024
+    def _get_resource(token: str, path: str) -> tuple:
+        """
+        Получает метаданные ресурса (GET /resources) с кэшированием на _RESOURCE_CACHE_TTL секунд.
+        Возвращает (данные, None) или (None, сообщение об ошибке)
+        """
+        cached = _cached_resource(token, path)
+        if cached is not None:
+            return cached, None
+
+        now = time.monotonic()
+        resp = _make_request_with_retry("GET", f"{BASE}/resources",
+                                        headers=_auth_headers(token), params={"path": path}, timeout=30)
+        if resp.status_code != 200:
+            return None, _json_error(resp)
+        data = _json_loads(resp.content)
+        _store_resource(token, path, now, data)
+        return data, None
+
+    def _download_href(token: str, path: str) -> Optional[str]:
+        """
+        Ссылка для скачивания файла с Диска. Метаданные ресурса (GET /resources, обычно из кэша)
+        уже содержат готовую ссылку в поле file — тогда отдельный /resources/download не нужен
+        """
+        file_data, _ = _get_resource(token, path)
+        if file_data and file_data.get("file"):
+            return file_data["file"]
+        resp = _make_request_with_retry("GET", f"{BASE}/resources/download",
+                                        headers=_auth_headers(token), params={"path": path}, timeout=30)
+        if resp.status_code != 200:
+            return None
+        return _json_loads(resp.content).get("href")
 
     def _make_request_with_retry(method: str, url: str, max_retries: int = 3, **kwargs) -> requests.Response:
         """
         Выполняет HTTP запрос с повторными попытками при ошибках
         """
         
-        # Специальные заголовки для Google Colab
-        colab_headers = {
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Cache-Control': 'max-age=0'
-        }
-        
-        # Добавляем заголовки если их нет
+        # Добавляем заголовки, не изменяя словарь вызывающего кода
+        # (один и тот же словарь заголовков может использоваться в нескольких запросах)
         if 'headers' not in kwargs:
-            kwargs['headers'] = colab_headers
+            kwargs['headers'] = _COLAB_HEADERS
         else:
-            kwargs['headers'].update(colab_headers)
+            kwargs['headers'] = {**kwargs['headers'], **_COLAB_HEADERS}
+        
+        method = method.upper()
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
         
         for attempt in range(max_retries):
             try:
-                if method.upper() == "GET":
-                    response = requests.get(url, **kwargs)
-                elif method.upper() == "POST":
-                    response = requests.post(url, **kwargs)
-                elif method.upper() == "PUT":
-                    response = requests.put(url, **kwargs)
-                elif method.upper() == "DELETE":
-                    response = requests.delete(url, **kwargs)
-                else:
-                    raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
+                response = session.request(method, url, **kwargs)
                 
-                # Если получили успешный ответ или ошибку клиента (4xx), не повторяем
-                if response.status_code < 500:
+                # Если получили успешный ответ или ошибку клиента (4xx), не повторяем;
+                # исключение — 429: Яндекс ограничивает частоту запросов, повтор с паузой помогает
+                if response.status_code < 500 and response.status_code != 429:
                     return response
                     
-                # Для серверных ошибок (5xx) повторяем
+                # Для серверных ошибок (5xx) и 429 повторяем; после последней попытки не ждем
                 if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # Экспоненциальная задержка
-                    time.sleep(wait_time)
+                    time.sleep(_backoff_delay(attempt, response))
                     continue
                     
             except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
                 if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt
-                    time.sleep(wait_time)
+                    time.sleep(_backoff_delay(attempt))
                     continue
                 else:
                     raise e
         
         return response
 
-    def _detect_environment() -> str:
-        """
-        Определяет среду выполнения (Google Colab, Jupyter, обычный Python)
-        """
-        try:
-            import google.colab
-            return "colab"
-        except ImportError:
-            try:
-                import IPython
-                if IPython.get_ipython() is not None:
-                    return "jupyter"
-            except ImportError:
-                pass
-        return "python"
-
-    def _get_colab_cache_dir() -> str:
-        """
-        Получает путь к директории кэша для Google Colab
-        """
-        cache_dir = "/content/yadisk_cache"
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        return cache_dir
-
-    def _save_to_colab_cache(file_data: bytes, filename: str, show_progress: bool = False) -> str:
-        """
-        Сохраняет файл в кэш Google Colab и возвращает путь к файлу
-        """
-        try:
-            cache_dir = _get_colab_cache_dir()
-            file_path = os.path.join(cache_dir, filename)
-            
-            with open(file_path, "wb") as f:
-                f.write(file_data)
-            
-            if show_progress:
-                sys.stdout.write(f"Файл сохранен в кэш: {file_path}\n")
-            
-            return file_path
-        except Exception as e:
-            if show_progress:
-                sys.stdout.write(f"Ошибка сохранения в кэш: {e}\n")
-            return None
-
     def _create_colab_download_link(file_path: str, filename: str, show_progress: bool = False) -> str:
         """
         Создает HTML-страницу для скачивания файла из кэша Google Colab
@@ -244,68 +935,19 @@ def yadisk_file_gateway(arguments):
             html_path = os.path.join(_get_colab_cache_dir(), html_filename)
             
             # Создаем HTML-страницу с автоматическим скачиванием
-            html_content = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <title>Скачивание файла: {filename}</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 40px; }}
-        .download-btn {{ 
-            background-color: #4CAF50; 
-            color: white; 
-            padding: 15px 32px; 
-            text-align: center; 
-            text-decoration: none; 
-            display: inline-block; 
-            font-size: 16px; 
-            margin: 4px 2px; 
-            cursor: pointer; 
-            border-radius: 4px;
-        }}
-        .info {{ background-color: #f0f0f0; padding: 15px; border-radius: 4px; margin: 20px 0; }}
-    </style>
-    <script>
-        // Автоматическое скачивание при загрузке страницы
-        window.onload = function() {{
-            var link = document.createElement('a');
-            link.href = '/content/yadisk_cache/{filename}';
-            link.download = '{filename}';
-            document.body.appendChild(link);
-            link.click();
-            document.body.removeChild(link);
-            
-            // Показываем сообщение
-            document.getElementById('message').innerHTML = 'Файл скачивается...';
-        }};
-    </script>
-</head>
-<body>
-    <h2>📁 Скачивание файла: {filename}</h2>
-    <div class="info">
-        <p><strong>Статус:</strong> <span id="message">Подготовка к скачиванию...</span></p>
-        <p><strong>Размер файла:</strong> {os.path.getsize(file_path) if os.path.exists(file_path) else 'Неизвестно'} байт</p>
-        <p><strong>Время создания:</strong> {time.strftime('%Y-%m-%d %H:%M:%S')}</p>
-    </div>
-    
-    <p>Если скачивание не началось автоматически:</p>
-    <a href="/content/yadisk_cache/{filename}" download="{filename}" class="download-btn">
-        📥 Скачать файл
-    </a>
-    
-    <div class="info">
-        <h3>Инструкции:</h3>
-        <ol>
-            <li>Файл должен скачаться автоматически</li>
-            <li>Если не работает, нажмите кнопку "Скачать файл" выше</li>
-            <li>Файл также доступен по пути: <code>/content/yadisk_cache/{filename}</code></li>
-        </ol>
-    </div>
-</body>
-</html>"""
+            # Размер одним stat вместо exists + getsize
+            try:
+                file_size = os.stat(file_path).st_size
+            except OSError:
+                file_size = 'Неизвестно'
+            html_content = _COLAB_CACHE_PAGE_TEMPLATE.substitute(
+                filename=filename,
+                file_size=file_size,
+                created_at=time.strftime('%Y-%m-%d %H:%M:%S'),
+            )
             
-            with open(html_path, "w", encoding="utf-8") as f:
-                f.write(html_content)
+            with open(html_path, "wb") as f:
+                f.write(html_content.encode("utf-8"))
             
             if show_progress:
                 sys.stdout.write(f"Создана HTML-страница для скачивания: {html_path}\n")
@@ -316,9 +958,13 @@ def yadisk_file_gateway(arguments):
                 sys.stdout.write(f"Ошибка создания HTML-страницы: {e}\n")
             return None
 
-    def _download_file_from_url(url: str, show_progress: bool = False) -> Optional[bytes]:
+    def _download_url_to_file(url: str, file_path: str, show_progress: bool = False,
+                              resume_offset: int = 0, progress_interval: float = 0.25) -> Optional[int]:
         """
-        Скачивает файл по URL в память
+        Скачивает файл по URL потоком прямо в file_path, не держа его в памяти.
+        При resume_offset > 0 запрашивает только хвост файла (Range): если сервер ответил 206 —
+        дописывает с этой позиции, если 200 (Range не поддерживается) — перезаписывает файл целиком.
+        Возвращает итоговый размер файла или None при ошибке
         """
         try:
             if show_progress:
@@ -329,96 +975,193 @@ def yadisk_file_gateway(arguments):
                 'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
                 'Accept': '*/*',
                 'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
+                # Файл качаем без сжатия: смещения Range и Content-Length относятся к самим байтам файла
+                'Accept-Encoding': 'identity',
                 'Connection': 'keep-alive',
                 'Referer': 'https://disk.yandex.ru/',
                 'Sec-Fetch-Dest': 'empty',
                 'Sec-Fetch-Mode': 'cors',
                 'Sec-Fetch-Site': 'cross-site'
             }
+            if resume_offset > 0:
+                headers['Range'] = f"bytes={resume_offset}-"
             
-            file_response = requests.get(url, headers=headers, stream=True, timeout=300, allow_redirects=True)
-            file_response.raise_for_status()
-            
-            # Читаем файл по частям
-            file_data = b""
-            total_size = int(file_response.headers.get('Content-Length', 0))
-            downloaded = 0
-            
-            for chunk in file_response.iter_content(chunk_size=8192):
-                if chunk:
-                    file_data += chunk
-                    downloaded += len(chunk)
-                    if show_progress and total_size > 0:
-                        percent = int(downloaded * 100 / total_size)
-                        sys.stdout.write(f"\rСкачивание: {percent}% ({downloaded}/{total_size} байт)")
-                        sys.stdout.flush()
-                    elif show_progress:
-                        sys.stdout.write(f"\rСкачано: {downloaded} байт")
-                        sys.stdout.flush()
+            with session.get(url, headers=headers, stream=True, timeout=300, allow_redirects=True) as file_response:
+                if file_response.status_code == 416 and resume_offset > 0:
+                    # Запрошенное смещение за концом файла — нечего докачивать
+                    if show_progress:
+                        sys.stdout.write("Файл уже скачан полностью\n")
+                    return resume_offset
+                file_response.raise_for_status()
+                
+                start = resume_offset if file_response.status_code == 206 else 0
+                if resume_offset > 0 and show_progress:
+                    if start:
+                        sys.stdout.write(f"Докачка с позиции {start} байт\n")
+                    else:
+                        sys.stdout.write("Сервер не поддерживает докачку, скачиваем файл заново\n")
+                
+                # Пишем чанки сразу в файл: в памяти держится только текущий чанк
+                total_size = int(file_response.headers.get('Content-Length', 0))
+                downloaded = 0
+                last_render = 0.0
+                next_tick = 0  # Сколько байт нужно скачать, чтобы процент вырос
+                
+                # Без буфера: чанки уже по 1 MB, и каждый уходит на диск одним системным
+                # вызовом, а не копируется сначала в буфер BufferedWriter того же размера
+                with open(file_path, "r+b" if start > 0 else "wb", buffering=0) as f:
+                    f.seek(start)
+                    f.truncate()
+                    for chunk in file_response.iter_content(chunk_size=_STREAM_CHUNK_SIZE):
+                        if chunk:
+                            view = memoryview(chunk)
+                            while view:
+                                view = view[f.write(view):]  # небуферизованная запись может быть частичной
+                            downloaded += len(chunk)
+                            # Перерисовываем прогресс не чаще раза в progress_interval секунд,
+                            # а при известном размере — только когда вырос процент
+                            if show_progress:
+                                if total_size > 0 and downloaded < next_tick:
+                                    continue
+                                now = time.monotonic()
+                                if now - last_render < progress_interval:
+                                    continue
+                                last_render = now
+                            if show_progress and total_size > 0:
+                                percent = min(downloaded * 100 // total_size, 100)
+                                next_tick = ((percent + 1) * total_size + 99) // 100
+                                _write_progress(f"\rСкачивание: {percent}% ({downloaded}/{total_size} байт)")
+                            elif show_progress:
+                                _write_progress(f"\rСкачано: {downloaded} байт")
             
             if show_progress:
-                sys.stdout.write(f"\nФайл скачан: {len(file_data)} байт\n")
+                sys.stdout.write(f"\nФайл скачан: {downloaded} байт\n")
+                sys.stdout.write(f"Файл сохранен в кэш: {file_path}\n")
             
-            return file_data
+            return start + downloaded
             
         except Exception as e:
             if show_progress:
                 sys.stdout.write(f"Ошибка скачивания по URL: {e}\n")
             return None
 
-    def _download_file_directly(token: str, disk_path: str, show_progress: bool = False) -> Optional[bytes]:
+    def _download_file_directly(token: str, disk_path: str, file_path: str, show_progress: bool = False,
+                                resume_offset: int = 0, progress_interval: float = 0.25) -> Optional[int]:
         """
-        Скачивает файл напрямую в память (для Google Colab)
+        Скачивает файл с Диска напрямую в file_path (для Google Colab).
+        Возвращает итоговый размер файла, см. _download_url_to_file
         """
         try:
-            headers = _auth_headers(token)
-            
             # Получаем ссылку для скачивания
-            download_resp = _make_request_with_retry("GET", f"{BASE}/resources/download", 
-                                                   headers=headers, params={"path": disk_path}, timeout=30)
-            if download_resp.status_code != 200:
-                return None
-            
-            href = download_resp.json().get("href")
+            href = _download_href(token, disk_path)
             if not href:
                 return None
             
             # Скачиваем файл по полученной ссылке
-            return _download_file_from_url(href, show_progress)
+            return _download_url_to_file(href, file_path, show_progress, resume_offset, progress_interval)
             
         except Exception as e:
             if show_progress:
                 sys.stdout.write(f"Ошибка прямого скачивания: {e}\n")
             return None
 
+    def _download_file_parallel(token: str, disk_path: str, filename: str, parts: int,
+                                show_progress: bool = False) -> Optional[int]:
+        """
+        Скачивает файл в кэш Google Colab несколькими параллельными Range-запросами
+        и пишет каждую часть на свое место в заранее выделенном файле.
+        Возвращает размер файла или None, если скачать частями не получилось
+        (сервер не поддерживает Range и т.п.) — тогда нужно скачивать одним потоком
+        """
+        if not hasattr(os, "pwrite"):
+            return None
+        file_path = None
+        try:
+            href = _download_href(token, disk_path)
+            if not href:
+                return None
+
+            # Узнаем размер и поддержку Range; берем конечный URL после редиректов,
+            # чтобы каждая часть не проходила редирект заново
+            head = session.head(href, timeout=30, allow_redirects=True)
+            size = int(head.headers.get("Content-Length", 0))
+            if head.status_code >= 400 or head.headers.get("Accept-Ranges") != "bytes" or size <= 0:
+                if show_progress:
+                    sys.stdout.write("Сервер не поддерживает скачивание частями, скачиваем в один поток\n")
+                return None
+            url = head.url
+
+            part_size = -(-size // parts)  # Округление вверх
+            ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+            if show_progress:
+                sys.stdout.write(f"Скачивание частями: {len(ranges)} x {part_size} байт\n")
+
+            file_path = os.path.join(_get_colab_cache_dir(), filename)
+            fd = os.open(file_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, size)
+
+                def fetch(byte_range):
+                    start, end = byte_range
+                    resp = session.get(url, headers={"Range": f"bytes={start}-{end}", "Accept-Encoding": "identity"},
+                                       stream=True, timeout=300)
+                    with resp:
+                        if resp.status_code != 206:
+                            raise IOError(f"Сервер вернул {resp.status_code} вместо 206 для части {start}-{end}")
+                        pos = start
+                        # Читаем прямо в буфер из пула, без новых bytes на каждый чанк
+                        buf = _acquire_buffer()
+                        try:
+                            with memoryview(buf) as view:
+                                while True:
+                                    n = resp.raw.readinto(buf)
+                                    if not n:
+                                        break
+                                    # pwrite может записать меньше n байт: дописываем остаток,
+                                    # иначе в файле осталась бы дыра из нулей
+                                    written = 0
+                                    while written < n:
+                                        written += os.pwrite(fd, view[written:n], pos + written)
+                                    pos += n
+                        finally:
+                            _release_buffer(buf)
+                    if pos != end + 1:
+                        raise IOError(f"Часть {start}-{end} скачана не полностью")
+
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    list(executor.map(fetch, ranges))
+            finally:
+                os.close(fd)
+
+            if show_progress:
+                sys.stdout.write(f"Файл скачан частями: {size} байт\n")
+            return size
+
+        except Exception as e:
+            if show_progress:
+                sys.stdout.write(f"Ошибка скачивания частями: {e}\n")
+            if file_path and os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            return None
+
     def _get_colab_compatible_url(token: str, disk_path: str, show_progress: bool = False) -> Optional[str]:
         """
         Получает URL, совместимый с Google Colab
         """
         try:
-            headers = _auth_headers(token)
-            
-            # Пытаемся получить информацию о файле
-            file_info = _make_request_with_retry("GET", f"{BASE}/resources", 
-                                               headers=headers, params={"path": disk_path}, timeout=30)
-            if file_info.status_code != 200:
+            # Проверяем, что файл существует
+            file_data, _ = _get_resource(token, disk_path)
+            if file_data is None:
                 return None
             
-            file_data = file_info.json()
-            
             # Пытаемся получить прямую ссылку для скачивания
-            download_resp = _make_request_with_retry("GET", f"{BASE}/resources/download", 
-                                                   headers=headers, params={"path": disk_path}, timeout=30)
-            if download_resp.status_code == 200:
-                href = download_resp.json().get("href")
-                if href:
-                    # Для Google Colab добавляем специальные параметры
-                    if "?" in href:
-                        href += "&disposition=attachment"
-                    else:
-                        href += "?disposition=attachment"
-                    return href
+            href = _download_href(token, disk_path)
+            if href:
+                # Для Google Colab добавляем специальные параметры
+                return _with_attachment_disposition(href)
             
             return None
             
@@ -433,15 +1176,26 @@ def yadisk_file_gateway(arguments):
         """
         try:
             headers = _auth_headers(token)
-            # Сначала пытаемся получить информацию о файле
-            file_info = _make_request_with_retry("GET", f"{BASE}/resources", 
-                                               headers=headers, params={"path": disk_path}, timeout=30)
-            if file_info.status_code != 200:
+            # Если свежие метаданные уже есть в кэше и файл опубликован — запросы не нужны
+            file_data = _cached_resource(token, disk_path)
+            if file_data is not None and file_data.get("public_url"):
+                if show_progress:
+                    sys.stdout.write(f"Получена публичная ссылка: {file_data['public_url']}\n")
+                return file_data["public_url"]
+            
+            # Публикация идемпотентна, поэтому отправляем ее параллельно с запросом информации
+            # о файле: для неопубликованного файла это экономит один последовательный запрос
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                publish_future = executor.submit(_make_request_with_retry, "PUT", f"{BASE}/resources/publish",
+                                                 headers=headers, params={"path": disk_path}, timeout=30)
+                file_data, error = _get_resource(token, disk_path)
+                publish_resp = publish_future.result()
+            
+            if file_data is None:
                 if show_progress:
-                    sys.stdout.write(f"Не удалось получить информацию о файле: {_json_error(file_info)}\n")
+                    sys.stdout.write(f"Не удалось получить информацию о файле: {error}\n")
                 return None
             
-            file_data = file_info.json()
             public_url = file_data.get("public_url")
             
             if public_url:
@@ -449,19 +1203,15 @@ def yadisk_file_gateway(arguments):
                     sys.stdout.write(f"Получена публичная ссылка: {public_url}\n")
                 return public_url
             
-            # Если нет публичной ссылки, пытаемся опубликовать файл
-            if show_progress:
-                sys.stdout.write("Файл не опубликован, пытаемся опубликовать...\n")
-            
-            publish_resp = _make_request_with_retry("PUT", f"{BASE}/resources/publish", 
-                                                  headers=headers, params={"path": disk_path}, timeout=30)
+            # Информация могла быть получена до того, как публикация применилась
             if publish_resp.status_code in (200, 201, 202):
-                # Повторно получаем информацию о файле
-                file_info = _make_request_with_retry("GET", f"{BASE}/resources", 
-                                                   headers=headers, params={"path": disk_path}, timeout=30)
-                if file_info.status_code == 200:
-                    file_data = file_info.json()
-                    public_url = file_data.get("public_url")
+                # Кэш устарел после публикации. Повторно нужна только ссылка — просим одно поле
+                # вместо полных метаданных
+                _invalidate_resource(token, disk_path)
+                resp = _make_request_with_retry("GET", f"{BASE}/resources", headers=headers,
+                                                params={"path": disk_path, "fields": "public_url"}, timeout=30)
+                if resp.status_code == 200:
+                    public_url = _json_loads(resp.content).get("public_url")
                     if public_url:
                         if show_progress:
                             sys.stdout.write(f"Файл опубликован, получена ссылка: {public_url}\n")
@@ -476,24 +1226,149 @@ def yadisk_file_gateway(arguments):
                 sys.stdout.write(f"Ошибка при получении публичной ссылки: {e}\n")
             return None
 
-    def _print_progress(prefix: str, done_bytes: int, total_bytes: Optional[int], last_percent: list, show: bool):
-        if not show:
-            return
-        if total_bytes and total_bytes > 0:
-            percent = int(done_bytes * 100 / total_bytes)
-            if percent == last_percent[0]:
-                return
-            last_percent[0] = percent
-            bar_len = 30
-            filled = int(percent * bar_len / 100)
-            bar = "#" * filled + "-" * (bar_len - filled)
-            sys.stdout.write(f"\r{prefix} [{bar}] {percent:3d}%")
-            sys.stdout.flush()
-            if percent >= 100:
-                sys.stdout.write("\n")
-        else:
-            sys.stdout.write(f"\r{prefix} {done_bytes} bytes...")
-            sys.stdout.flush()
+    def _save_public_to_disk(token: str, public_key: str, disk_path: str, overwrite: bool,
+                             show_progress: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Копирует опубликованный файл Яндекс.Диска в disk_path на стороне сервера (save-to-disk).
+        Возвращает итоговый ответ upload или None, если копирование не подходит — тогда файл
+        загружается обычным путем (скачивание и PUT)
+        """
+        try:
+            headers = _auth_headers(token)
+            # Проверки независимы: что по ссылке (файл, а не папка) и свободен ли путь на Диске.
+            # save-to-disk не перезаписывает файл, поэтому при overwrite существующий файл
+            # заменяет обычная загрузка
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                meta_future = executor.submit(_make_request_with_retry, "GET", f"{BASE}/public/resources",
+                                              headers=headers, params={"public_key": public_key,
+                                                                       "fields": "type,size"}, timeout=30)
+                existing, _ = _get_resource(token, disk_path)
+                meta = meta_future.result()
+            if existing is not None and not overwrite:
+                # Обычная загрузка получила бы тот же 409 от запроса ссылки, но для страницы
+                # публичного файла она не сработала бы вовсе — отвечаем конфликтом сразу
+                return {"ok": False, "message": f"HTTP 409: ресурс {disk_path} уже существует"}
+            if existing is not None or meta.status_code != 200:
+                return None
+            meta_data = _json_loads(meta.content)
+            if meta_data.get("type") != "file":
+                return None
+
+            parent_dir, _, name = disk_path.rpartition("/")
+            save_path = parent_dir if parent_dir and parent_dir != "disk:" else "disk:/"
+            if show_progress:
+                sys.stdout.write("Публичный файл Яндекс.Диска: копируем на стороне сервера...\n")
+            r = _make_request_with_retry("POST", f"{BASE}/public/resources/save-to-disk", headers=headers,
+                                         params={"public_key": public_key, "name": name, "save_path": save_path},
+                                         timeout=30)
+            if r.status_code == 202:
+                # Копирование идет асинхронно: ждем завершения операции
+                operation_href = _json_loads(r.content).get("href")
+                if not operation_href:
+                    return None
+                # Сбой самого опроса (5xx/429 после повторов, обрыв соединения) не означает, что
+                # копирование не удалось: оно может еще идти, и обычная загрузка поверх него
+                # дала бы конкурирующую запись. Отказываемся только по статусу failed или по таймауту
+                deadline = time.monotonic() + _OPERATION_TIMEOUT
+                while True:
+                    status = None
+                    try:
+                        op = _make_request_with_retry("GET", operation_href, headers=headers, timeout=30)
+                        if op.status_code == 200:
+                            status = _json_loads(op.content).get("status")
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                        pass
+                    if status == "success":
+                        break
+                    if status == "failed":
+                        if show_progress:
+                            sys.stdout.write("Копирование на стороне сервера не удалось\n")
+                        return None
+                    if time.monotonic() > deadline:
+                        # Операция может еще завершиться: вторая запись поверх нее дала бы гонку,
+                        # поэтому возвращаем ссылку на операцию для проверки статуса
+                        return {"ok": False, "message": "Копирование на стороне сервера еще выполняется", "data": {
+                            "disk_path": disk_path,
+                            "operation_href": operation_href
+                        }}
+                    time.sleep(_OPERATION_POLL_INTERVAL)
+            elif r.status_code == 409 and not overwrite:
+                # Файл появился по disk_path уже после проверки
+                return {"ok": False, "message": _json_error(r)}
+            elif r.status_code != 201:
+                if show_progress:
+                    sys.stdout.write(f"Копирование на стороне сервера недоступно: {_json_error(r)}\n")
+                return None
+
+            # Файл должен оказаться именно по disk_path (а не под другим именем)
+            _invalidate_resource(token, disk_path)
+            saved, _ = _get_resource(token, disk_path)
+            if saved is None:
+                return None
+            return {"ok": True, "message": "Файл скопирован на Яндекс.Диск", "data": {
+                "disk_path": disk_path,
+                "file_size": saved.get("size") or meta_data.get("size") or 0,
+                "file_url": _result_link(token, disk_path, show_progress)
+            }}
+
+        except Exception as e:
+            if show_progress:
+                sys.stdout.write(f"Ошибка копирования на стороне сервера: {e}\n")
+            return None
+
+    def _result_link(token: str, path: str, show_progress: bool = False) -> str:
+        """
+        Ссылка на файл для ответа upload/rename: публичная — только по return_public_url
+        (публикация и запросы к API), иначе ссылка в веб-интерфейсе Диска, построенная из пути
+        """
+        if not return_public_url:
+            return _disk_client_url(path)
+        public_url = _get_public_url(token, path, show_progress)
+        if not public_url:
+            # Если не удалось получить публичную ссылку, возвращаем путь на диске
+            if show_progress:
+                sys.stdout.write(f"Публичная ссылка недоступна, используем путь: {path}\n")
+            return path
+        return public_url
+
+    def _load_list_cache(cache_path: str) -> Dict[str, Any]:
+        """
+        Читает кэш результатов list (ETag + тело ответа) из JSON-файла
+        """
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _update_list_cache(cache_path: str, key: str, entry: Dict[str, Any]) -> None:
+        """
+        Добавляет запись в кэш результатов list и атомарно перезаписывает файл.
+        Файл перечитывается под блокировкой: записи параллельных вызовов list не теряются,
+        а у каждого писателя свой временный файл
+        """
+        with _LIST_CACHE_LOCK:
+            cache = _load_list_cache(cache_path)
+            cache[key] = entry
+            tmp_path = None
+            try:
+                cache_dir = os.path.dirname(cache_path)
+                if cache_dir and not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                fd, tmp_path = tempfile.mkstemp(dir=cache_dir or ".", suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(cache, f, ensure_ascii=False)
+                os.replace(tmp_path, cache_path)
+                tmp_path = None
+            except OSError:
+                pass
+            finally:
+                if tmp_path is not None:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
 
     # --- Функция для извлечения прямой ссылки на файл из публичной ссылки Яндекс.Диска ---
     def _extract_direct_download_url(public_url: str, show_progress: bool = False) -> Optional[str]:
@@ -513,8 +1388,7 @@ def yadisk_file_gateway(arguments):
             return None
             
         # Проверка на потенциально опасные символы
-        dangerous_chars = ['<', '>', '"', "'", '&', '\x00']
-        if any(char in public_url for char in dangerous_chars):
+        if _PUBLIC_URL_BAD_RE.search(public_url):
             if show_progress:
                 sys.stdout.write("URL содержит потенциально опасные символы\n")
             return None
@@ -533,7 +1407,7 @@ def yadisk_file_gateway(arguments):
             # Получаем HTML страницу
             if show_progress:
                 sys.stdout.write(f"Получение HTML страницы: {public_url}\n")
-            response = requests.get(public_url, headers=headers, timeout=30, allow_redirects=True)
+            response = session.get(public_url, headers=headers, timeout=30, allow_redirects=True)
             response.raise_for_status()
 
             # Ищем скрипт с данными, содержащими downloadUrl
@@ -542,7 +1416,7 @@ def yadisk_file_gateway(arguments):
             # Пример регулярного выражения для поиска downloadUrl (может потребоваться доработка)
             # Паттерн может меняться, поэтому проверяйте, соответствует ли он реальному содержимому страницы
             # Этот шаблон может быть не самым надежным, но работает для простых случаев
-            match = re.search(r'"downloadUrl":"([^"]+)"', html_content)
+            match = _RE_DOWNLOAD_URL.search(html_content)
             if match:
                 download_url = match.group(1)
                 # Убедимся, что URL корректен и начинается с https://downloader.disk.yandex.ru/
@@ -560,7 +1434,7 @@ def yadisk_file_gateway(arguments):
             # Попробуем найти другие возможные пути (например, ссылки в JS)
             # Ищем ссылки вида "https://downloader.disk.yandex.ru/..." в JS
             # Это более сложный подход, но может помочь
-            js_match = re.search(r'https://downloader\.disk\.yandex\.ru/[^\s"\']+', html_content)
+            js_match = _RE_DIRECT_URL.search(html_content)
             if js_match:
                 direct_url = js_match.group(0)
                 if show_progress:
@@ -574,30 +1448,34 @@ def yadisk_file_gateway(arguments):
             # Попробуем найти данные о файле в JSON внутри HTML (часто встречается)
             # Поиск JSON-объекта с информацией о файле
             # Пример: <script id="react-data">{"someKey":"someValue"}</script>
-            data_match = re.search(r'<script[^>]*id=["\']react-data["\'][^>]*>(.*?)</script>', html_content, re.DOTALL)
+            json_data_str = None
+            data_match = _RE_REACT_DATA_OPEN.search(html_content)
             if data_match:
+                script_end = html_content.find("</script>", data_match.end())
+                if script_end != -1:
+                    json_data_str = html_content[data_match.end():script_end]
+            if json_data_str is not None:
                 try:
-                    json_data_str = data_match.group(1)
                     # Попробуем найти downloadUrl в этом JSON
                     # Простой парсинг, может не всегда работать
-                    json_data = json.loads(json_data_str)
+                    json_data = _json_loads(json_data_str)
 
                     # Ищем в структуре, например, если есть ключи с downloadUrl
                     # Это зависит от внутренней структуры данных Яндекс.Диска
                     # Ниже пример для общего случая
                     def find_download_url(obj):
-                        if isinstance(obj, dict):
-                            if 'downloadUrl' in obj:
-                                return obj['downloadUrl']
-                            for value in obj.values():
-                                result = find_download_url(value)
-                                if result:
-                                    return result
-                        elif isinstance(obj, list):
-                            for item in obj:
-                                result = find_download_url(item)
-                                if result:
-                                    return result
+                        # Обход в глубину явным стеком: без рекурсии (и RecursionError на глубоком JSON);
+                        # дочерние элементы кладутся в обратном порядке, чтобы порядок обхода не менялся
+                        stack = [obj]
+                        while stack:
+                            current = stack.pop()
+                            if isinstance(current, dict):
+                                url = current.get('downloadUrl')
+                                if url:
+                                    return url
+                                stack.extend(reversed(list(current.values())))
+                            elif isinstance(current, list):
+                                stack.extend(reversed(current))
                         return None
 
                     found_url = find_download_url(json_data)
@@ -629,177 +1507,40 @@ def yadisk_file_gateway(arguments):
                 sys.stdout.write(f"Ошибка при парсинге: {e}\n")
             return None
 
-    # file-like с прогрессом для upload из URL (потоковая загрузка)
-    class ProgressURLFile:
-        def __init__(self, url, show):
-            self._url = url
-            self._show = show
-            self._last_percent = None
-            self._read = 0
-            self._size = 0
-            self._response = None
-            self._closed = False
-            self._error = None
-            self._chunk_iterator = None
-
-            # Инициализируем потоковое соединение
-            try:
-                if self._show:
-                    sys.stdout.write("Инициализация потокового соединения...\n")
-                    sys.stdout.flush()
-
-                # Настройки для надежного скачивания
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept': '*/*',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept-Encoding': 'identity',  # Отключаем сжатие для точности
-                    'Connection': 'keep-alive',
-                    'Cache-Control': 'no-cache'
-                }
-
-                # Используем stream=True для потокового скачивания
-                self._response = requests.get(
-                    url,
-                    headers=headers,
-                    timeout=600,
-                    allow_redirects=True,
-                    stream=True,  # Важно: потоковое скачивание
-                    verify=True  # Проверяем SSL сертификаты
-                )
-
-                # Проверяем статус код после открытия соединения
-                self._response.raise_for_status()
-
-                # Проверка Content-Type
-                content_type = self._response.headers.get('Content-Type', '')
-                if 'text/html' in content_type.lower():
-                    self._error = f"Получен HTML-ответ ({content_type}) вместо файла! Проверьте URL."
-                    if self._show:
-                        sys.stdout.write(f"Ошибка: {self._error}\n")
-                    return
-
-                # Получаем размер файла из заголовков
-                content_length = self._response.headers.get('Content-Length')
-                if content_length:
-                    self._size = int(content_length)
-                    if self._show:
-                        sys.stdout.write(f"Размер файла: {self._size} байт\n")
-                else:
-                    if self._show:
-                        sys.stdout.write("Размер файла неизвестен, будет показан прогресс в байтах\n")
-
-                # Проверка Content-Disposition для определения имени файла
-                content_disposition = self._response.headers.get('Content-Disposition', '')
-                if 'filename=' in content_disposition:
-                    filename = content_disposition.split('filename=')[1].strip('"\'')
-                    if self._show:
-                        sys.stdout.write(f"Имя файла по заголовку: {filename}\n")
-
-                # Создаем итератор для потокового чтения
-                self._chunk_iterator = self._response.iter_content(chunk_size=8192)
-
-                if self._show:
-                    sys.stdout.write(f"Content-Type: {content_type}\n")
-                    sys.stdout.write("Начинаем потоковую загрузку на Яндекс.Диск...\n")
-                    sys.stdout.flush()
-
-            except requests.exceptions.RequestException as e:
-                self._error = f"Ошибка сети при инициализации соединения: {e}"
-                if self._show:
-                    sys.stdout.write(f"\nОшибка: {self._error}\n")
-            except Exception as e:
-                self._error = f"Неожиданная ошибка при инициализации: {e}"
-                if self._show:
-                    sys.stdout.write(f"\nОшибка: {self._error}\n")
-
-        def __len__(self):
-            return self._size
-
-        def read(self, amt=1024 * 1024):
-            if self._closed or self._chunk_iterator is None:
-                return b""
-
-            try:
-                # Читаем следующий чанк из потока
-                chunk = next(self._chunk_iterator, b"")
-                if chunk:
-                    self._read += len(chunk)
-                    
-                    # Показываем прогресс загрузки
-                    if self._show:
-                        if self._size > 0:
-                            percent = int(self._read * 100 / self._size)
-                            if percent != self._last_percent:
-                                self._last_percent = percent
-                                bar_len = 30
-                                filled = int(percent * bar_len / 100)
-                                bar = "#" * filled + "-" * (bar_len - filled)
-                                sys.stdout.write(f"\rЗагрузка на диск [{bar}] {percent:3d}%")
-                                sys.stdout.flush()
-
-                            if self._read >= self._size:
-                                sys.stdout.write("\n")
-                        else:
-                            # Если размер неизвестен, показываем в байтах
-                            sys.stdout.write(f"\rЗагружено: {self._read} байт")
-                            sys.stdout.flush()
-
-                return chunk
-
-            except StopIteration:
-                # Поток закончился
-                if self._show and self._size == 0:
-                    sys.stdout.write(f"\nЗагрузка завершена: {self._read} байт\n")
-                return b""
-            except Exception as e:
-                self._error = f"Ошибка при чтении потока: {e}"
-                if self._show:
-                    sys.stdout.write(f"\nОшибка: {self._error}\n")
-                return b""
-
-        def close(self):
-            self._closed = True
-            # Закрываем потоковое соединение
-            try:
-                if self._response:
-                    self._response.close()
-                if self._show:
-                    sys.stdout.write("Потоковое соединение закрыто\n")
-                    sys.stdout.flush()
-            except Exception:
-                pass
-
-        def has_error(self):
-            """Возвращает True, если произошла ошибка при загрузке"""
-            return self._error is not None
-
-        def get_error(self):
-            """Возвращает сообщение об ошибке"""
-            return self._error
-
     # ---------- args ----------
     action = arguments.get("action")
     token = (arguments.get("oauth_token") or "").strip()
+
+    # Валидация входных параметров — до приведения типов ниже,
+    # чтобы некорректное значение вернулось сообщением, а не исключением
+    validation_error = _validate_inputs(arguments, action, token)
+    if validation_error:
+        return {"ok": False, "message": validation_error}
+
     disk_path = _norm_disk_path(arguments.get("disk_path", ""))
     new_name = arguments.get("new_name")
     local_path = arguments.get("local_path")  # локальный путь к файлу
     file_url = arguments.get("file_url")  # URL файла для загрузки
     overwrite = bool(arguments.get("overwrite", True))
     show_progress = bool(arguments.get("show_progress", True))
+    # Минимальный интервал перерисовки прогресса, сек (значение уже проверено в _validate_inputs)
+    progress_interval = arguments.get("progress_interval")
+    progress_interval = 0.25 if progress_interval is None else float(progress_interval)
     chunk_override = arguments.get("chunk_size")
     chunk_override = int(chunk_override) if isinstance(chunk_override, int) and chunk_override > 0 else None
     public_key = arguments.get("public_key")
     public_path = arguments.get("public_path")
-    limit = int(arguments.get("limit", 100))
-    offset = int(arguments.get("offset", 0))
+    # Числовые параметры разбираем только для действий, которые их используют (см. _validate_inputs)
+    limit = int(arguments.get("limit", 100)) if action == "list" else 100
+    offset = int(arguments.get("offset", 0)) if action == "list" else 0
     direct_download = bool(arguments.get("direct_download", False))  # Прямое скачивание для Colab
+    resume_offset = arguments.get("resume_offset")  # Сколько байт файла уже лежит в кэше (докачка)
+    expected_total = arguments.get("expected_total")  # Полный размер файла, если Диск его не сообщил
+    parallel_parts = int(arguments.get("parallel_parts") or 1) if action == "download" else 1  # Число параллельных Range-запросов (Colab)
+    cache_path = arguments.get("cache_path")  # JSON-файл кэша list (ETag/If-None-Match)
+    fetch_all = bool(arguments.get("fetch_all", False))  # list: все страницы начиная с offset
+    return_public_url = bool(arguments.get("return_public_url", False))  # upload/rename/list: публиковать и возвращать public_url
 
-    # Валидация входных параметров
-    validation_error = _validate_inputs(arguments)
-    if validation_error:
-        return {"ok": False, "message": validation_error}
-    
     # Автоматическая подмена limit <= 0 на минимальное значение (защита от ошибок моделей)
     # Минимальный лимит для Яндекс.Диска: 10 (0 означает "верни 0 элементов" и ломает логику)
     MIN_LIMIT = 10
@@ -836,6 +1577,12 @@ def yadisk_file_gateway(arguments):
                 sys.stdout.write(f"Проверка ссылки: {file_url}\n")
             if not file_url.startswith(("http://", "https://")):
                 return {"ok": False, "message": "Указанная ссылка не является URL."}
+            # Опубликованный файл Яндекс.Диска копируем на стороне сервера: байты не идут через гейтвей
+            if urlsplit(file_url).hostname in _YADISK_PUBLIC_HOSTS:
+                saved = _save_public_to_disk(token, file_url, disk_path, overwrite, show_progress)
+                if saved is not None:
+                    return saved
+
             # Проверим, если это публичная ссылка (не прямая)
             # Для Яндекс.Диска: если это не downloader.disk.yandex.ru
             if "disk.yandex.ru" in file_url and not file_url.startswith("https://downloader.disk.yandex.ru/"):
@@ -845,58 +1592,87 @@ def yadisk_file_gateway(arguments):
                 if not direct_url:
                     return {"ok": False,
                             "message": "Не удалось извлечь прямую ссылку на файл. Убедитесь, что указана прямая ссылка на файл."}
-            else:
-                # Проверим, является ли это прямой ссылкой (на случай, если пользователь уже указал её)
-                # Можно добавить проверку доступности файла
-                try:
-                    check_resp = requests.head(file_url, timeout=10)
-                    if check_resp.status_code >= 400:
-                        return {"ok": False, "message": f"Указанная ссылка недоступна (код {check_resp.status_code})."}
-                except Exception as e:
-                    return {"ok": False, "message": f"Ошибка проверки ссылки: {e}"}
 
-            headers = _auth_headers(token)
-            params = {"path": disk_path, "overwrite": "true" if overwrite else "false"}
-            r = _make_request_with_retry("GET", f"{BASE}/resources/upload", headers=headers, params=params, timeout=30)
-            if r.status_code not in (200, 201):
-                return {"ok": False, "message": _json_error(r)}
-            href = r.json().get("href")
-            if not href:
-                return {"ok": False, "message": "Не получена ссылка для загрузки"}
-
-            # Используем ProgressURLFile для загрузки по URL
-            pf = ProgressURLFile(direct_url, show_progress)  # Используем direct_url
+            # Ссылку, полученную для прошлой (неудавшейся) попытки загрузки, используем повторно —
+            # только при overwrite: без него проверку существования файла делает запрос ссылки
+            upload_key = (token, disk_path)
+            href = _cached_upload_href(upload_key) if overwrite else None
 
-            # Проверяем, произошла ли ошибка при загрузке файла
-            if pf.has_error():
-                error_msg = pf.get_error()
-                if show_progress:
-                    sys.stdout.write(f"Ошибка при загрузке файла: {error_msg}\n")
-                return {"ok": False, "message": f"Не удалось загрузить файл с URL: {error_msg}"}
-
-            # Получаем размер файла из заголовков (может быть 0 если неизвестен)
-            file_size = len(pf)  # размер из заголовков HTTP
+            # Запрос ссылки загрузки и открытие источника независимы (разные хосты),
+            # поэтому ссылку у Диска запрашиваем параллельно с HEAD/GET источника
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                upload_future = None
+                if not href:
+                    headers = _auth_headers(token)
+                    params = {"path": disk_path, "overwrite": "true" if overwrite else "false"}
+                    upload_future = executor.submit(_make_request_with_retry, "GET", f"{BASE}/resources/upload",
+                                                    headers=headers, params=params, timeout=30)
+
+                # Используем ProgressURLFile для загрузки по URL.
+                # Отдельной проверки доступности ссылки нет: статус источника проверяется
+                # на том же GET, которым файл потом передается
+                # Размер чанка PUT: chunk_size из аргументов или по размеру файла (_choose_chunk_size)
+                pf = ProgressURLFile(session, direct_url, show_progress, progress_interval, chunk_override)  # Используем direct_url
+
+                # Ошибка источника важнее ответа Диска: ссылка загрузки без файла не нужна
+                if pf.has_error():
+                    error_msg = pf.get_error()
+                    pf.close()
+                    if show_progress:
+                        sys.stdout.write(f"Ошибка при загрузке файла: {error_msg}\n")
+                    return {"ok": False, "message": f"Не удалось загрузить файл с URL: {error_msg}"}
+
+                if upload_future is not None:
+                    try:
+                        r = upload_future.result()
+                    except BaseException:
+                        pf.close()
+                        raise
+                    if r.status_code not in (200, 201):
+                        pf.close()
+                        return {"ok": False, "message": _json_error(r)}
+                    href = _json_loads(r.content).get("href")
+                    if not href:
+                        pf.close()
+                        return {"ok": False, "message": "Не получена ссылка для загрузки"}
+                    if overwrite:
+                        _store_upload_href(upload_key, href)
+
+            # Размер файла из заголовков (0, если источник его не сообщил — тогда chunked)
+            put_headers = {"Content-Type": _content_type(disk_path)}
+            if len(pf):
+                put_headers["Content-Length"] = str(len(pf))
 
             try:
-                # Используем data=pf, который реализует read()
-                put = _make_request_with_retry("PUT", href, max_retries=2,  # Меньше попыток для больших файлов
+                # Передаем pf потоком: данные из источника сразу уходят на Диск.
+                # Поток нельзя прочитать повторно, поэтому PUT не повторяем
+                # stream=True: тело ответа при успехе не нужно, его не вычитываем
+                put = _make_request_with_retry("PUT", href, max_retries=1,
                     data=pf,
-                    headers={"Content-Type": "application/octet-stream"},
+                    headers=put_headers,
+                    stream=True,
                                              timeout=600)
             finally:
                 pf.close()
 
+            # Обрыв чтения источника посреди передачи: при chunked-загрузке Диск принял бы
+            # укороченный файл как целый
+            if pf.has_error():
+                return {"ok": False, "message": f"Не удалось загрузить файл с URL: {pf.get_error()}"}
             if put.status_code not in (200, 201, 202):
+                # 4xx — ссылка больше не принимается (истекла, уже использована): следующей
+                # попытке нужна новая; при 5xx оставляем ее для повтора
+                if put.status_code < 500:
+                    _drop_upload_href(upload_key)
                 return {"ok": False, "message": _json_error(put)}
+            put.close()  # Соединение возвращается в пул без чтения тела
+            # Размер — сколько байт реально передано (известен и при chunked-загрузке)
+            file_size = pf.get_bytes_read()
+            _drop_upload_href(upload_key)
+            _invalidate_resource(token, disk_path)
 
             # --- Получение ссылки на загруженный файл ---
-            # После успешной загрузки получаем публичную ссылку
-            file_url_on_disk = _get_public_url(token, disk_path, show_progress)
-            if not file_url_on_disk:
-                # Если не удалось получить публичную ссылку, возвращаем путь на диске
-                file_url_on_disk = disk_path
-                if show_progress:
-                    sys.stdout.write(f"Публичная ссылка недоступна, используем путь: {disk_path}\n")
+            file_url_on_disk = _result_link(token, disk_path, show_progress)
 
             return {"ok": True, "message": "Файл успешно загружен", "data": {
                 "disk_path": disk_path,
@@ -914,12 +1690,10 @@ def yadisk_file_gateway(arguments):
                 headers = _auth_headers(token)
                 
                 # Сначала получаем информацию о файле
-                file_info = _make_request_with_retry("GET", f"{BASE}/resources", 
-                                                   headers=headers, params={"path": disk_path}, timeout=30)
-                if file_info.status_code != 200:
-                    return {"ok": False, "message": f"Файл не найден: {_json_error(file_info)}"}
+                file_data, error = _get_resource(token, disk_path)
+                if file_data is None:
+                    return {"ok": False, "message": f"Файл не найден: {error}"}
                 
-                file_data = file_info.json()
                 file_size = file_data.get("size")
                 
                 href = None
@@ -933,51 +1707,81 @@ def yadisk_file_gateway(arguments):
                     if show_progress:
                         sys.stdout.write("Скачивание файла в кэш Google Colab...\n")
                     
-                    file_data = _download_file_directly(token, disk_path, show_progress)
-                    if file_data:
-                        # Определяем имя файла
-                        filename = os.path.basename(disk_path.replace("disk:/", ""))
-                        if not filename:
-                            filename = f"downloaded_file_{int(time.time())}"
-                        
-                        # Сохраняем файл в кэш
-                        cached_file_path = _save_to_colab_cache(file_data, filename, show_progress)
-                        if cached_file_path:
-                            # Создаем HTML-страницу для скачивания
-                            html_path = _create_colab_download_link(cached_file_path, filename, show_progress)
-                            
+                    # Определяем имя файла: последний сегмент пути, один вызов rpartition
+                    filename = disk_path.rpartition("/")[2]
+                    if not filename:
+                        filename = f"downloaded_file_{int(time.time())}"
+                    
+                    # Докачка: продолжаем не дальше того, что реально лежит в кэше
+                    start_offset = 0
+                    if resume_offset is not None:
+                        cached_path = os.path.join(_get_colab_cache_dir(), filename)
+                        # Один stat вместо exists + getsize
+                        try:
+                            existing_size = os.stat(cached_path).st_size
+                        except OSError:
+                            existing_size = 0
+                        start_offset = min(int(resume_offset), existing_size)
+                    # Размер из метаданных Диска (уже получены выше) надежнее переданного вызывающим:
+                    # expected_total — только запасной вариант, если Диск размер не сообщил
+                    total = file_size if file_size is not None else (
+                        int(expected_total) if expected_total is not None else None)
+                    
+                    cached_file_path = None
+                    cached_size = 0
+                    # Скачивание частями в несколько соединений (только для нового файла, не для докачки)
+                    if parallel_parts > 1 and not start_offset:
+                        parallel_size = _download_file_parallel(token, disk_path, filename, parallel_parts, show_progress)
+                        if parallel_size is not None:
+                            cached_file_path = os.path.join(_get_colab_cache_dir(), filename)
+                            cached_size = parallel_size
+                    
+                    if not cached_file_path:
+                        target_path = os.path.join(_get_colab_cache_dir(), filename)
+                        if start_offset and total is not None and start_offset >= total:
                             if show_progress:
-                                sys.stdout.write(f"Файл сохранен в кэш: {cached_file_path}\n")
-                                if html_path:
-                                    sys.stdout.write(f"HTML-страница создана: {html_path}\n")
-                            
-                            return {
-                                "ok": True, 
-                                "message": "Файл успешно скачан и сохранен в кэш", 
-                                "data": {
-                                    "filename": filename,
-                                    "file_size": len(file_data),
-                                    "environment": environment,
-                                    "download_method": "colab_cache",
-                                    "disk_path": disk_path,
-                                    "cached_file_path": cached_file_path,
-                                    "html_download_page": html_path,
-                                    "direct_file_url": f"/content/yadisk_cache/{filename}",
-                                    "instructions": [
-                                        f"1. Файл сохранен в кэш: {cached_file_path}",
-                                        f"2. Откройте HTML-страницу: {html_path}",
-                                        f"3. Или используйте прямую ссылку: /content/yadisk_cache/{filename}",
-                                        "4. Файл будет скачан автоматически при открытии HTML-страницы"
-                                    ]
-                                }
-                            }
+                                sys.stdout.write("Файл уже полностью в кэше, скачивание не требуется\n")
+                            downloaded_size = start_offset
                         else:
-                            if show_progress:
-                                sys.stdout.write("Ошибка сохранения в кэш, пробуем получить ссылку...\n")
-                    else:
-                        if show_progress:
+                            # Скачиваем потоком прямо в файл кэша
+                            downloaded_size = _download_file_directly(token, disk_path, target_path, show_progress,
+                                                                      start_offset, progress_interval)
+                        if downloaded_size is not None:
+                            cached_file_path = target_path
+                            cached_size = downloaded_size
+                        elif show_progress:
                             sys.stdout.write("Прямое скачивание не удалось, пробуем получить ссылку...\n")
                     
+                    if cached_file_path:
+                        # Создаем HTML-страницу для скачивания
+                        html_path = _create_colab_download_link(cached_file_path, filename, show_progress)
+
+                        if show_progress:
+                            sys.stdout.write(f"Файл сохранен в кэш: {cached_file_path}\n")
+                            if html_path:
+                                sys.stdout.write(f"HTML-страница создана: {html_path}\n")
+
+                        return {
+                            "ok": True, 
+                            "message": "Файл успешно скачан и сохранен в кэш", 
+                            "data": {
+                                "filename": filename,
+                                "file_size": cached_size,
+                                "environment": environment,
+                                "download_method": "colab_cache",
+                                "disk_path": disk_path,
+                                "cached_file_path": cached_file_path,
+                                "html_download_page": html_path,
+                                "direct_file_url": f"/content/yadisk_cache/{filename}",
+                                "instructions": [
+                                    f"1. Файл сохранен в кэш: {cached_file_path}",
+                                    f"2. Откройте HTML-страницу: {html_path}",
+                                    f"3. Или используйте прямую ссылку: /content/yadisk_cache/{filename}",
+                                    "4. Файл будет скачан автоматически при открытии HTML-страницы"
+                                ]
+                            }
+                        }
+                    
                     href = _get_colab_compatible_url(token, disk_path, show_progress)
                     if href:
                         if show_progress:
@@ -997,40 +1801,41 @@ def yadisk_file_gateway(arguments):
                         if show_progress:
                             sys.stdout.write(f"Попытка {download_attempts}/{max_attempts} получить ссылку для скачивания...\n")
                         
-                        r = _make_request_with_retry("GET", f"{BASE}/resources/download", 
-                                                   headers=headers, params={"path": disk_path}, timeout=30)
-                        
-                        if r.status_code == 200:
-                            href = r.json().get("href")
-                            if href:
-                                # Для Google Colab добавляем специальные параметры
-                                if environment == "colab":
-                                    if "?" in href:
-                                        href += "&disposition=attachment"
+                        # Первая попытка — готовая ссылка из метаданных (поле file), без отдельного запроса
+                        if download_attempts == 1 and file_data.get("file"):
+                            href = file_data["file"]
+                        else:
+                            r = _make_request_with_retry("GET", f"{BASE}/resources/download",
+                                                         headers=headers, params={"path": disk_path}, timeout=30)
+                            if r.status_code == 200:
+                                href = _json_loads(r.content).get("href")
+                            elif show_progress:
+                                sys.stdout.write(f"Ошибка получения ссылки: {_json_error(r)}\n")
+
+                        if href:
+                            # Для Google Colab добавляем специальные параметры
+                            if environment == "colab":
+                                href = _with_attachment_disposition(href)
+                            
+                            # Проверяем работоспособность ссылки (только если не Colab)
+                            if environment != "colab":
+                                try:
+                                    # Редирект на CDN не проходим: 3xx уже значит, что ссылка жива
+                                    check_response = session.head(href, timeout=10, allow_redirects=False)
+                                    if check_response.status_code >= 400:
+                                        if show_progress:
+                                            sys.stdout.write(f"Ссылка недоступна (код {check_response.status_code}), пробуем снова...\n")
+                                        href = None  # Сбрасываем, чтобы попробовать снова
                                     else:
-                                        href += "?disposition=attachment"
-                                
-                                # Проверяем работоспособность ссылки (только если не Colab)
-                                if environment != "colab":
-                                    try:
-                                        check_response = requests.head(href, timeout=10, allow_redirects=True)
-                                        if check_response.status_code >= 400:
-                                            if show_progress:
-                                                sys.stdout.write(f"Ссылка недоступна (код {check_response.status_code}), пробуем снова...\n")
-                                            href = None  # Сбрасываем, чтобы попробовать снова
-                                        else:
-                                            if show_progress:
-                                                sys.stdout.write("Ссылка для скачивания получена и проверена\n")
-                                    except Exception as e:
                                         if show_progress:
-                                            sys.stdout.write(f"Ошибка проверки ссылки: {e}, пробуем снова...\n")
-                                        href = None
-                                else:
+                                            sys.stdout.write("Ссылка для скачивания получена и проверена\n")
+                                except Exception as e:
                                     if show_progress:
-                                        sys.stdout.write("Ссылка для скачивания получена (Colab режим)\n")
-                        else:
-                            if show_progress:
-                                sys.stdout.write(f"Ошибка получения ссылки: {_json_error(r)}\n")
+                                        sys.stdout.write(f"Ошибка проверки ссылки: {e}, пробуем снова...\n")
+                                    href = None
+                            else:
+                                if show_progress:
+                                    sys.stdout.write("Ссылка для скачивания получена (Colab режим)\n")
                 
                 if not href:
                     # Если не удалось получить прямую ссылку, попробуем получить публичную ссылку
@@ -1051,42 +1856,18 @@ def yadisk_file_gateway(arguments):
                         sys.stdout.write("Создаем альтернативную ссылку для скачивания...\n")
                     
                     # Создаем HTML-страницу для скачивания
-                    filename = os.path.basename(disk_path.replace("disk:/", ""))
+                    filename = disk_path.rpartition("/")[2]
                     if not filename:
                         filename = "downloaded_file"
                     
                     # Создаем простую HTML-страницу с автоматическим скачиванием
-                    html_content = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <title>Скачивание файла</title>
-    <script>
-        // Автоматическое скачивание при загрузке страницы
-        window.onload = function() {{
-            var link = document.createElement('a');
-            link.href = '{href}';
-            link.download = '{filename}';
-            document.body.appendChild(link);
-            link.click();
-            document.body.removeChild(link);
-            
-            // Показываем сообщение
-            document.getElementById('message').innerHTML = 'Файл скачивается...';
-        }};
-    </script>
-</head>
-<body>
-    <h2>Скачивание файла: {filename}</h2>
-    <p id="message">Подготовка к скачиванию...</p>
-    <p>Если скачивание не началось автоматически, <a href="{href}" download="{filename}">нажмите здесь</a></p>
-</body>
-</html>"""
+                    html_content = _REDIRECT_PAGE_TEMPLATE.substitute(href=href, filename=filename)
                     
                     # Сохраняем HTML-файл
                     html_filename = f"download_{filename}.html"
-                    with open(html_filename, "w", encoding="utf-8") as f:
-                        f.write(html_content)
+                    # Страница пишется одной записью: кодируем сразу, без текстового слоя
+                    with open(html_filename, "wb") as f:
+                        f.write(html_content.encode("utf-8"))
                     
                     if show_progress:
                         sys.stdout.write(f"Создана HTML-страница для скачивания: {html_filename}\n")
@@ -1120,7 +1901,7 @@ def yadisk_file_gateway(arguments):
                                            params=params, timeout=30)
                 if r.status_code != 200:
                     return {"ok": False, "message": _json_error(r)}
-                href = r.json().get("href")
+                href = _json_loads(r.content).get("href")
                 if not href:
                     return {"ok": False, "message": "Сервис не вернул href для скачивания"}
                 file_size = None
@@ -1173,23 +1954,22 @@ def yadisk_file_gateway(arguments):
             headers = _auth_headers(token)
             from_path = disk_path
             # Правильная обработка путей: если файл в корне диска, parent_dir будет пустым
-            path_parts = from_path.split("/")
-            if len(path_parts) > 1 and path_parts[-1]:  # есть имя файла
-                parent_dir = "/".join(path_parts[:-1])
+            # rpartition вместо split + join: делим только по последнему "/"
+            parent_dir, sep, last_part = from_path.rpartition("/")
+            if sep and last_part:  # есть имя файла
                 to_path = f"{parent_dir}/{new_name}" if parent_dir else f"disk:/{new_name}"
             else:
                 # Если путь заканчивается на "/" или это корень диска
                 to_path = f"{from_path.rstrip('/')}/{new_name}" if from_path != "disk:/" else f"disk:/{new_name}"
             params = {"from": from_path, "path": to_path, "overwrite": "true"}
-            r = requests.post(f"{BASE}/resources/move", headers=headers, params=params, timeout=30)
+            r = _make_request_with_retry("POST", f"{BASE}/resources/move", headers=headers, params=params, timeout=30)
+            _invalidate_resource(token, from_path)
+            _invalidate_resource(token, to_path)
             if r.status_code not in (200, 201, 202):
                 return {"ok": False, "message": _json_error(r)}
 
-            # Получаем ссылку на переименованный файл
-            file_link = _get_public_url(token, to_path, show_progress)
-            if not file_link:
-                # Если не удалось получить публичную ссылку, используем путь на диске
-                file_link = to_path
+            # Получаем ссылку на переименованный файл (публичную — только по return_public_url)
+            file_link = _result_link(token, to_path, show_progress)
 
             return {"ok": True, "message": f"Файл переименован в {new_name}",
                     "data": {"old_path": from_path, "new_path": to_path, "file_url": file_link}}
@@ -1201,8 +1981,9 @@ def yadisk_file_gateway(arguments):
             if not disk_path:
                 return {"ok": False, "message": "Для delete требуется disk_path"}
             headers = _auth_headers(token)
-            r = requests.delete(f"{BASE}/resources", headers=headers, params={"path": disk_path, "permanently": "true"},
-                                timeout=30)
+            r = _make_request_with_retry("DELETE", f"{BASE}/resources", headers=headers,
+                                         params={"path": disk_path, "permanently": "true"}, timeout=30)
+            _invalidate_resource(token, disk_path)
             if r.status_code not in (202, 204):
                 return {"ok": False, "message": _json_error(r)}
             return {"ok": True, "message": "Файл удален", "data": {"disk_path": disk_path}}
@@ -1218,32 +1999,87 @@ def yadisk_file_gateway(arguments):
                 "path": disk_path,
                 "limit": limit,
                 "offset": offset,
-                "fields": "_embedded.items.name,_embedded.items.type,_embedded.items.size,_embedded.items.mime_type,_embedded.items.path,_embedded.total"
+                "fields": "_embedded.items.name,_embedded.items.type,_embedded.items.size,_embedded.items.mime_type,_embedded.items.path,_embedded.items.public_url,_embedded.total"
             }
-            r = requests.get(f"{BASE}/resources", headers=headers, params=params, timeout=30)
-            if r.status_code != 200:
+
+            # Кэш по ETag: если папка не менялась, сервер ответит 304 без тела
+            list_cache = None
+            cache_key = None
+            cached_entry = None
+            if cache_path:
+                cache_file = os.path.expanduser(cache_path)
+                list_cache = _load_list_cache(cache_file)
+                token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+                cache_key = f"{token_hash}|{disk_path}|{limit}|{offset}"
+                cached_entry = list_cache.get(cache_key)
+                if cached_entry and cached_entry.get("etag"):
+                    headers = {**headers, "If-None-Match": cached_entry["etag"]}
+
+            r = _make_request_with_retry("GET", f"{BASE}/resources", headers=headers, params=params, timeout=30)
+            if r.status_code == 304 and cached_entry:
+                if show_progress:
+                    sys.stdout.write("Содержимое папки не изменилось, используем кэш\n")
+                j = cached_entry["body"]
+            elif r.status_code != 200:
                 return {"ok": False, "message": _json_error(r)}
-            j = r.json()
+            else:
+                j = _json_loads(r.content)
+                etag = r.headers.get("ETag")
+                if list_cache is not None and etag:
+                    _update_list_cache(cache_file, cache_key, {"etag": etag, "body": j})
             embedded = j.get("_embedded", {})
             items = embedded.get("items", [])
             total = embedded.get("total", len(items))
+
+            # fetch_all: total известен из первой страницы, поэтому остальные страницы
+            # запрашиваем сразу все параллельно, а не по одной подряд
+            if fetch_all and items and total > offset + limit:
+                page_offsets = range(offset + limit, total, limit)
+                with ThreadPoolExecutor(max_workers=min(6, len(page_offsets))) as executor:
+                    pages = list(executor.map(
+                        lambda off: _make_request_with_retry("GET", f"{BASE}/resources", headers=_auth_headers(token),
+                                                             params={**params, "offset": off}, timeout=30),
+                        page_offsets))
+                items = list(items)  # Тело из кэша list не изменяем
+                for page in pages:  # executor.map сохраняет порядок страниц
+                    if page.status_code != 200:
+                        return {"ok": False, "message": _json_error(page)}
+                    items.extend(_json_loads(page.content).get("_embedded", {}).get("items", []))
             simplified = []
+            file_items = []
             for it in items:
+                get = it.get  # Метод берется один раз на элемент, а не на каждое поле
                 item_data = {
-                    "name": it.get("name"),
-                    "type": it.get("type"),
-                    "size": it.get("size"),
-                    "mime_type": it.get("mime_type"),
-                    "path": it.get("path")
+                    "name": get("name"),
+                    "type": get("type"),
+                    "size": get("size"),
+                    "mime_type": get("mime_type"),
+                    "path": get("path")
                 }
-                # Добавляем ссылку на файл, если это файл
-                if it.get("type") == "file":
-                    item_path = it.get("path", "")
-                    # Пытаемся получить публичную ссылку для каждого файла
-                    public_url = _get_public_url(token, item_path, False)  # Без показа прогресса для каждого файла
-                    item_data["file_url"] = public_url or item_path
+                if item_data["type"] == "file":
+                    # Уже опубликованный файл приходит со ссылкой прямо в листинге
+                    public_url = get("public_url")
+                    if public_url:
+                        item_data["file_url"] = public_url
+                    else:
+                        file_items.append(item_data)
                 simplified.append(item_data)
 
+            # Неопубликованным файлам без return_public_url — ссылка в веб-интерфейсе из пути,
+            # без публикации и запросов к API
+            if file_items and not return_public_url:
+                for item_data in file_items:
+                    item_data["file_url"] = _disk_client_url(item_data["path"] or "")
+            # Иначе публикуем: запросы по файлам независимы, поэтому идут
+            # параллельно по общему пулу соединений, а не по одному на файл подряд
+            elif file_items:
+                file_paths = [item_data["path"] or "" for item_data in file_items]
+                with ThreadPoolExecutor(max_workers=min(6, len(file_paths))) as executor:
+                    # Без показа прогресса для каждого файла
+                    public_urls = list(executor.map(lambda p: _get_public_url(token, p, False), file_paths))
+                for item_data, item_path, public_url in zip(file_items, file_paths, public_urls):
+                    item_data["file_url"] = public_url or item_path
+
             return {"ok": True, "message": f"Элементов: {len(simplified)} из {total}",
                     "data": {"disk_path": disk_path, "total": total, "limit": limit, "offset": offset,
                              "items": simplified}}